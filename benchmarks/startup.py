@@ -0,0 +1,91 @@
+from argparse import ArgumentParser
+from json import dump
+from os import remove
+from os.path import exists, join
+from statistics import median
+from subprocess import DEVNULL, check_call
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from hierarchicalrecord.confcache import cache_path
+from hierarchicalrecord.recordconf import RecordConf
+
+"""
+Measures how long one validatehr process takes, start to finish, with and
+without the compiled conf cache.
+
+    $ python benchmarks/startup.py
+    $ python benchmarks/startup.py --runs 50 record.json conf.csv
+
+Without a record and conf, a synthetic conf of --fields rules and a record
+which satisfies it are generated.
+"""
+
+
+def write_synthetic(directory, fields):
+    conf = RecordConf()
+    record = {}
+    for i in range(fields):
+        conf.add_rule({"Field Name": "field{}x".format(i),
+                       "Value Type": "dict", "Obligation": "r",
+                       "Cardinality": "1", "Validation": "",
+                       "Children Required": "1"})
+        conf.add_rule({"Field Name": "field{}x.value".format(i),
+                       "Value Type": "str", "Obligation": "r",
+                       "Cardinality": "n", "Validation": "^v[0-9]+$",
+                       "Children Required": ""})
+        record["field{}x".format(i)] = [{"value": ["v{}".format(i)]}]
+    conf_fp = join(directory, "conf.csv")
+    record_fp = join(directory, "record.json")
+    conf.to_csv(conf_fp)
+    with open(record_fp, "w") as f:
+        dump(record, f)
+    return record_fp, conf_fp
+
+
+def time_runs(record_fp, conf_fp, runs, extra_args):
+    command = [executable, "-m", "hierarchicalrecord.bin.validaterecord",
+               record_fp, conf_fp, "--just-result"] + extra_args
+    times = []
+    for x in range(runs):
+        start = perf_counter()
+        check_call(command, stdout=DEVNULL)
+        times.append(perf_counter() - start)
+    return times
+
+
+def report(label, times):
+    print("{:<24} median {:8.1f} ms   min {:8.1f} ms".format(
+        label, median(times) * 1000, min(times) * 1000))
+
+
+def main():
+    parser = ArgumentParser(description="Time validatehr start up, with " +
+                            "and without the compiled conf cache")
+    parser.add_argument("record_filepath", nargs="?", default=None)
+    parser.add_argument("config_filepath", nargs="?", default=None)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--fields", type=int, default=200,
+                        help="The number of fields in the synthetic conf")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        if args.record_filepath is None or args.config_filepath is None:
+            record_fp, conf_fp = write_synthetic(directory, args.fields)
+        else:
+            record_fp, conf_fp = args.record_filepath, args.config_filepath
+        cold = time_runs(record_fp, conf_fp, args.runs, ["--no-conf-cache"])
+        if exists(cache_path(conf_fp)):
+            remove(cache_path(conf_fp))
+        # The first cached run writes the cache
+        time_runs(record_fp, conf_fp, 1, [])
+        warm = time_runs(record_fp, conf_fp, args.runs, [])
+        baseline = time_runs(record_fp, conf_fp, args.runs, ["--help"])
+    report("interpreter + imports", baseline)
+    report("no conf cache", cold)
+    report("conf cache", warm)
+
+
+if __name__ == "__main__":
+    main()
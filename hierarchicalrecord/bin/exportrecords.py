@@ -0,0 +1,87 @@
+from argparse import ArgumentParser
+from sys import stderr, stdout
+
+from hierarchicalrecord.bulkloader import load_records
+from hierarchicalrecord.confregistry import conf_from_file
+from hierarchicalrecord.tabularexport import write_long, write_wide
+
+
+def loaded_records(record_filepaths, threads=16):
+    for path, r in load_records(record_filepaths, threads=threads):
+        if isinstance(r, Exception):
+            print("could not load {}: {}".format(path, r), file=stderr)
+            continue
+        yield (path, r)
+
+
+def main():
+    parser = ArgumentParser(description="Export hierarchicalrecords as " +
+                            "CSV or TSV rows.")
+    parser.add_argument(
+        "record_filepath",
+        type=str,
+        nargs="+",
+        help="The file paths of the records, or quoted glob patterns"
+    )
+    parser.add_argument(
+        "--out",
+        type=str,
+        help="Where to write the rows, - for stdout. A .tsv path writes " +
+        "TSV, anything else CSV",
+        required=True
+    )
+    parser.add_argument(
+        "--wide",
+        type=str,
+        metavar="CONF",
+        help="Write one row per record, with a column per field of this " +
+        "conf, rather than one row per leaf",
+        default=None
+    )
+    parser.add_argument(
+        "--tsv",
+        action="store_true",
+        help="Write TSV whatever --out is called",
+        default=False
+    )
+    parser.add_argument(
+        "--joiner",
+        type=str,
+        help="What to put between the values of a repeated field, with " +
+        "--wide",
+        default="|"
+    )
+    parser.add_argument(
+        "--no-header",
+        action="store_true",
+        help="Leave out the header row",
+        default=False
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="The number of threads reading records",
+        default=16
+    )
+
+    args = parser.parse_args()
+
+    delimiter = ","
+    if args.tsv or args.out.lower().endswith(".tsv"):
+        delimiter = "\t"
+    out = args.out
+    if out == "-":
+        out = stdout
+    records = loaded_records(args.record_filepath, threads=args.threads)
+    if args.wide is not None:
+        rows = write_wide(records, out, conf_from_file(args.wide),
+                          delimiter=delimiter, joiner=args.joiner,
+                          header=not args.no_header)
+    else:
+        rows = write_long(records, out, delimiter=delimiter,
+                          header=not args.no_header)
+    print("wrote {} rows".format(rows), file=stderr)
+
+
+if __name__ == "__main__":
+    main()
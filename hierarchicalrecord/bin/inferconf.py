@@ -0,0 +1,84 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from json import dumps
+from sys import stderr
+
+from hierarchicalrecord.bulkloader import expand_paths, load_records
+from hierarchicalrecord.confprofiler import ConfProfiler
+
+
+def profile_paths(record_filepaths, threads=16):
+    profiler = ConfProfiler()
+    for path, r in load_records(record_filepaths, ordered=False,
+                                threads=threads):
+        if isinstance(r, Exception):
+            print("could not load {}: {}".format(path, r), file=stderr)
+            continue
+        profiler.add(r)
+    return profiler
+
+
+def profile_in_shards(record_filepaths, shards, threads=16):
+    paths = list(expand_paths(record_filepaths))
+    profiler = ConfProfiler()
+    with ProcessPoolExecutor(max_workers=shards) as pool:
+        jobs = [pool.submit(profile_paths, paths[i::shards], threads)
+                for i in range(shards)]
+        for job in jobs:
+            profiler.merge(job.result())
+    return profiler
+
+
+def main():
+    parser = ArgumentParser(description="Infer a hierarchicalrecord conf " +
+                            "from a corpus of records.")
+    parser.add_argument(
+        "record_filepath",
+        type=str,
+        nargs="+",
+        help="The file paths of the records, or quoted glob patterns"
+    )
+    parser.add_argument(
+        "--out",
+        type=str,
+        help="Where to write the conf. A .json path writes line JSON, " +
+        "anything else CSV",
+        required=True
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="Profile the corpus in this many parallel processes",
+        default=1
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="The number of threads reading records in each process",
+        default=16
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Also print the raw per field counters",
+        default=False
+    )
+
+    args = parser.parse_args()
+
+    if args.shards > 1:
+        profiler = profile_in_shards(args.record_filepath, args.shards,
+                                     threads=args.threads)
+    else:
+        profiler = profile_paths(args.record_filepath, threads=args.threads)
+    conf = profiler.to_conf()
+    if args.out.lower().endswith((".json", ".jsonl", ".ndjson")):
+        conf.to_json(args.out)
+    else:
+        conf.to_csv(args.out)
+    if args.stats:
+        print(dumps(profiler.to_dict(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,227 @@
-from json import dumps
+from collections import deque
+from json import dumps, loads
 from argparse import ArgumentParser
 
+from hierarchicalrecord.confcache import load_validator
 from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
-from hierarchicalrecord.recordconf import RecordConf
-from hierarchicalrecord.recordvalidator import RecordValidator
+from hierarchicalrecord.validationresults import ValidationAggregator
 
 
-def make_validator(conf_fp):
-    conf = RecordConf()
-    conf.from_csv(conf_fp)
-    return RecordValidator(conf)
+def make_validator(conf_fp, use_cache=True):
+    return load_validator(conf_fp, use_cache=use_cache)
 
 
 def validate_record(record, validator):
-    validation = validator.validate(record)
+    # validate_many() gives the same results as validate(), without
+    # rescanning the record for every rule
+    validation = validator.validate_many([record])[0]
     return validation
 
 
-def pprint_result(validation, just_result=False):
+class _Unloadable(Exception):
+    """a record file which couldn't be read or parsed"""
+    pass
+
+
+class _Unvalidatable(Exception):
+    """a record which makes the validator raise"""
+    pass
+
+
+def _validate_loaded(validator, records, structured=False):
+    # One record which makes validate() raise mustn't sink the rest of its
+    # batch, so on failure go through validate() once per record to find
+    # out which it was. Only the message is kept, as it is all that gets
+    # reported and it keeps what comes back from a worker small
+    try:
+        return validator.validate_many(records, structured=structured)
+    except Exception:
+        pass
+    results = []
+    for record in records:
+        try:
+            results.append(validator.validate(record, structured=structured))
+        except Exception as e:
+            results.append(_Unvalidatable(str(e) or type(e).__name__))
+    return results
+
+
+def pprint_result(validation, just_result=False, record_filepath=None):
     pp_result = {"valid": validation[0],
                  "errors": validation[1]}
+    if record_filepath is not None:
+        pp_result["record"] = record_filepath
     if not just_result:
         print(dumps(pp_result, indent=4))
     else:
         q_pp_result = {"valid": pp_result['valid']}
+        if record_filepath is not None:
+            q_pp_result["record"] = record_filepath
         print(dumps(q_pp_result, indent=4))
 
 
+# The validator of a --processes worker, built once when the worker starts
+_worker_validator = []
+
+
+def _start_worker(conf_fp, use_cache):
+    _worker_validator.append(make_validator(conf_fp, use_cache=use_cache))
+
+
+def validate_paths(record_filepaths, structured=False):
+    # Runs in a worker, which reads, parses and validates the files itself
+    # so that only paths go out and results come back. A file which can't
+    # be loaded comes back with just the message, not the exception, which
+    # for a JSON error holds the whole file
+    results = []
+    records = []
+    for path in record_filepaths:
+        try:
+            with open(path, "rb") as f:
+                data = loads(f.read())
+            r = HierarchicalRecord()
+            r.set_data(data)
+        except Exception as e:
+            results.append((path, _Unloadable(str(e))))
+            continue
+        results.append([path, None])
+        records.append(r)
+    validated = iter(_validate_loaded(_worker_validator[0], records,
+                                      structured=structured))
+    for x in results:
+        if x[1] is None:
+            x[1] = next(validated)
+    return [tuple(x) for x in results]
+
+
+def validate_in_processes(record_filepaths, conf_fp, processes,
+                          use_cache=True, structured=False, ordered=True,
+                          chunk_size=64):
+    # Only needed for many records, and slower to import than validating
+    # a single one
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, \
+        wait
+    from hierarchicalrecord.bulkloader import expand_paths
+
+    def chunks():
+        chunk = []
+        for path in expand_paths(record_filepaths):
+            chunk.append(path)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_start_worker,
+                             initargs=(conf_fp, use_cache)) as pool:
+        in_flight = deque()
+        for chunk in chunks():
+            if len(in_flight) >= processes * 2:
+                if ordered:
+                    done = [in_flight.popleft()]
+                else:
+                    done = wait(in_flight, return_when=FIRST_COMPLETED)[0]
+                    for x in done:
+                        in_flight.remove(x)
+                for x in done:
+                    for y in x.result():
+                        yield y
+            in_flight.append(pool.submit(validate_paths, chunk, structured))
+        for x in in_flight:
+            for y in x.result():
+                yield y
+
+
+def validate_paths_here(record_filepaths, validator, structured=False,
+                        ordered=True, threads=16, chunk_size=64):
+    from hierarchicalrecord.bulkloader import load_records
+
+    def validated(chunk):
+        results = iter(_validate_loaded(
+            validator, [x[1] for x in chunk
+                        if not isinstance(x[1], Exception)],
+            structured=structured))
+        for path, r in chunk:
+            if isinstance(r, Exception):
+                yield (path, _Unloadable(str(r)))
+            else:
+                yield (path, next(results))
+
+    chunk = []
+    for x in load_records(record_filepaths, ordered=ordered,
+                          threads=threads):
+        chunk.append(x)
+        if len(chunk) >= chunk_size:
+            for y in validated(chunk):
+                yield y
+            chunk = []
+    for y in validated(chunk):
+        yield y
+
+
+def results_for(record_filepaths, validator, conf_fp, use_cache=True,
+                structured=False, ordered=True, threads=16, processes=0):
+    # yields (path, result), or (path, exception) for a file which couldn't
+    # be loaded (_Unloadable) or a record which couldn't be validated
+    # (_Unvalidatable)
+    if processes:
+        return validate_in_processes(record_filepaths, conf_fp, processes,
+                                     use_cache=use_cache,
+                                     structured=structured, ordered=ordered)
+    return validate_paths_here(record_filepaths, validator,
+                               structured=structured, ordered=ordered,
+                               threads=threads)
+
+
+def validate_many(record_filepaths, validator, conf_fp, just_result=False,
+                  ordered=True, threads=16, processes=0, use_cache=True):
+    for path, result in results_for(record_filepaths, validator, conf_fp,
+                                    use_cache=use_cache, ordered=ordered,
+                                    threads=threads, processes=processes):
+        if isinstance(result, _Unvalidatable):
+            result = (False, ["Could not validate record: {}".format(result)])
+        elif isinstance(result, Exception):
+            result = (False, ["Could not load record: {}".format(result)])
+        pprint_result(result, just_result=just_result, record_filepath=path)
+
+
+def summarize_many(record_filepaths, validator, conf_fp, threads=16,
+                   processes=0, use_cache=True, max_unloadable_examples=10):
+    aggregator = ValidationAggregator()
+    # Files which couldn't be loaded, and records the validator raised on,
+    # are counted, with the first few paths of each kept as examples
+    failed = {"unloadable": [0, []], "unvalidatable": [0, []]}
+    for path, result in results_for(record_filepaths, validator, conf_fp,
+                                    use_cache=use_cache, structured=True,
+                                    ordered=False, threads=threads,
+                                    processes=processes):
+        if isinstance(result, Exception):
+            if isinstance(result, _Unvalidatable):
+                counts = failed["unvalidatable"]
+            else:
+                counts = failed["unloadable"]
+            counts[0] += 1
+            if len(counts[1]) < max_unloadable_examples:
+                counts[1].append(path)
+            continue
+        aggregator.add(result)
+    summary = aggregator.to_dict()
+    for kind, (total, examples) in sorted(failed.items()):
+        summary[kind] = total
+        summary[kind + "_examples"] = examples
+    print(dumps(summary, indent=4))
+
+
 def main():
     parser = ArgumentParser(description="A quick hierarchicalrecord " +
                             "validation script.")
     parser.add_argument(
         "record_filepath",
         type=str,
-        help="The file path to the record"
+        nargs="+",
+        help="The file path to the record. Several paths, or quoted glob " +
+        "patterns, validate many records at once"
     )
     parser.add_argument(
         "config_filepath",
@@ -47,12 +235,61 @@ def main():
         default=False
     )
 
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Print error counts per rule and field across all the " +
+        "records, rather than each record's result",
+        default=False
+    )
+    parser.add_argument(
+        "--no-conf-cache",
+        action="store_true",
+        help="Parse the config afresh rather than using, or writing, the " +
+        "compiled copy cached beside it",
+        default=False
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="The number of threads reading records, when validating many",
+        default=16
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="The number of processes reading and validating records, " +
+        "when validating many. Defaults to validating in this process",
+        default=0
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="Print results as records finish loading, rather than in the " +
+        "order given",
+        default=False
+    )
+
     args = parser.parse_args()
 
-    v = make_validator(args.config_filepath)
-    r = HierarchicalRecord(from_file=args.record_filepath)
-    result = validate_record(r, v)
-    pprint_result(result, just_result=args.just_result)
+    v = make_validator(args.config_filepath,
+                       use_cache=not args.no_conf_cache)
+    record_filepaths = args.record_filepath
+    if args.summary:
+        summarize_many(record_filepaths, v, args.config_filepath,
+                       threads=args.threads, processes=args.processes,
+                       use_cache=not args.no_conf_cache)
+    elif len(record_filepaths) == 1 and \
+            not any(c in record_filepaths[0] for c in "*?["):
+        r = HierarchicalRecord(from_file=record_filepaths[0])
+        result = validate_record(r, v)
+        pprint_result(result, just_result=args.just_result)
+    else:
+        validate_many(record_filepaths, v, args.config_filepath,
+                      just_result=args.just_result,
+                      ordered=not args.unordered, threads=args.threads,
+                      processes=args.processes,
+                      use_cache=not args.no_conf_cache)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+import asyncio
+from argparse import ArgumentParser
+from json import dumps
+from subprocess import Popen
+from sys import executable, stderr, stdin, stdout
+
+from hierarchicalrecord.workqueue import QueueCoordinator, QueueWorker
+
+
+def start_local_workers(host, port, n):
+    command = [executable, "-m", "hierarchicalrecord.bin.validationqueue",
+               "worker", "--host", host, "--port", str(port)]
+    return [Popen(command) for x in range(n)]
+
+
+async def coordinate(args, records, out):
+    coordinator = QueueCoordinator(args.config_filepath, records, out,
+                                   lease_size=args.lease_size,
+                                   lease_timeout=args.lease_timeout,
+                                   max_attempts=args.max_attempts,
+                                   max_outstanding=args.max_outstanding,
+                                   structured=args.structured)
+    workers = []
+    try:
+        host, port = await coordinator.start_tcp(args.host, args.port)
+        print("coordinating on {}:{}".format(host, port), file=stderr,
+              flush=True)
+        workers = start_local_workers(host, port, args.local_workers)
+        summary = await coordinator.wait_finished()
+    finally:
+        await coordinator.close()
+        for worker in workers:
+            worker.wait()
+    print(dumps(summary), file=stderr)
+
+
+def run_coordinator(args):
+    if args.records_filepath == "-":
+        records = stdin
+    else:
+        records = open(args.records_filepath, "r")
+    if args.out is None:
+        out = stdout
+    else:
+        out = open(args.out, "w")
+    try:
+        asyncio.run(coordinate(args, records, out))
+    finally:
+        if records is not stdin:
+            records.close()
+        if out is not stdout:
+            out.close()
+
+
+def run_worker(args):
+    worker = QueueWorker(args.host, args.port)
+    worker.run()
+
+
+def main():
+    parser = ArgumentParser(description="Validate a stream of records " +
+                            "across many worker processes and machines.")
+    subparsers = parser.add_subparsers(dest="mode")
+    subparsers.required = True
+
+    coordinator = subparsers.add_parser(
+        "coordinator",
+        help="Lease records out to workers and write their results in order"
+    )
+    coordinator.add_argument(
+        "records_filepath",
+        type=str,
+        help="A file of records, one JSON object per line, or - for stdin"
+    )
+    coordinator.add_argument(
+        "config_filepath",
+        type=str,
+        help="The file path to the config"
+    )
+    coordinator.add_argument(
+        "--host",
+        type=str,
+        help="The address to listen for workers on",
+        default="127.0.0.1"
+    )
+    coordinator.add_argument(
+        "--port",
+        type=int,
+        help="The TCP port to listen for workers on",
+        default=8766
+    )
+    coordinator.add_argument(
+        "--out",
+        type=str,
+        help="Where to write the results. Defaults to stdout",
+        default=None
+    )
+    coordinator.add_argument(
+        "--lease-size",
+        type=int,
+        help="The number of records handed to a worker at once",
+        default=256
+    )
+    coordinator.add_argument(
+        "--lease-timeout",
+        type=float,
+        help="Seconds before a lease that hasn't come back is retried",
+        default=60.0
+    )
+    coordinator.add_argument(
+        "--max-attempts",
+        type=int,
+        help="How many times a lease is tried before its records are " +
+        "reported as failed",
+        default=3
+    )
+    coordinator.add_argument(
+        "--max-outstanding",
+        type=int,
+        help="The most leases read ahead of the oldest unfinished one",
+        default=64
+    )
+    coordinator.add_argument(
+        "--structured",
+        action="store_true",
+        help="Report errors as JSON objects rather than messages",
+        default=False
+    )
+    coordinator.add_argument(
+        "--local-workers",
+        type=int,
+        help="Also start this many workers on this machine",
+        default=0
+    )
+
+    worker = subparsers.add_parser(
+        "worker",
+        help="Validate records leased from a coordinator"
+    )
+    worker.add_argument(
+        "--host",
+        type=str,
+        help="The coordinator's address",
+        default="127.0.0.1"
+    )
+    worker.add_argument(
+        "--port",
+        type=int,
+        help="The coordinator's TCP port",
+        default=8766
+    )
+
+    args = parser.parse_args()
+
+    try:
+        if args.mode == "coordinator":
+            run_coordinator(args)
+        else:
+            run_worker(args)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
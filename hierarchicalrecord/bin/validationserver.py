@@ -0,0 +1,126 @@
+import asyncio
+from argparse import ArgumentParser
+
+from sys import stderr
+
+from hierarchicalrecord.confregistry import ConfRegistry
+from hierarchicalrecord.validationserver import ValidationServer
+
+
+def parse_conf_arg(conf_arg):
+    if "=" not in conf_arg:
+        raise ValueError("confs must be given as NAME=PATH")
+    name, conf_fp = conf_arg.split("=", 1)
+    return name, conf_fp
+
+
+def report_swap(old, new):
+    if old is not None:
+        print("reloaded {}".format(new.tag()), file=stderr, flush=True)
+
+
+def report_error(name, e):
+    print("could not reload {}: {}".format(name, e), file=stderr, flush=True)
+
+
+async def serve(args):
+    registry = ConfRegistry(poll_interval=args.poll_interval,
+                            on_swap=report_swap, on_error=report_error)
+    server = ValidationServer(registry=registry,
+                              max_workers=args.workers,
+                              max_pending=args.max_pending,
+                              batch_size=args.batch_size,
+                              batch_delay=args.batch_delay)
+    for conf_arg in args.conf:
+        name, conf_fp = parse_conf_arg(conf_arg)
+        server.load_conf(name, conf_fp)
+    if args.watch:
+        registry.start_watching()
+    try:
+        if args.unix_socket is not None:
+            where = await server.start_unix(args.unix_socket)
+        else:
+            where = await server.start_tcp(args.host, args.port)
+        print("validating {} on {}".format(", ".join(server.conf_names()),
+                                           where), flush=True)
+        await server.serve_forever()
+    finally:
+        registry.stop_watching()
+        await server.close()
+
+
+def main():
+    parser = ArgumentParser(description="A long running hierarchicalrecord " +
+                            "validation service.")
+    parser.add_argument(
+        "--conf",
+        action="append",
+        default=[],
+        required=True,
+        help="A conf to load, as NAME=PATH. May be given more than once."
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        help="The address to listen on",
+        default="127.0.0.1"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="The TCP port to listen on",
+        default=8765
+    )
+    parser.add_argument(
+        "--unix-socket",
+        type=str,
+        help="Listen on this unix socket instead of TCP",
+        default=None
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Reload conf files when they change",
+        default=False
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        help="Seconds between checks for changed conf files",
+        default=1.0
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="The number of validation processes. Defaults to the CPU count",
+        default=None
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        help="The most requests in flight before the server stops reading",
+        default=1024
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="The most records handed to a worker at once",
+        default=64
+    )
+    parser.add_argument(
+        "--batch-delay",
+        type=float,
+        help="Seconds a partial batch waits before being dispatched",
+        default=0.002
+    )
+
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from glob import iglob
+from json import loads
+from os.path import exists
+
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+
+"""
+Loads many HierarchicalRecord JSON files at once.
+
+Opening, reading and parsing each file happens in a thread pool, so the
+latency of slow (eg network mounted) storage overlaps. At most [prefetch]
+files are in flight at a time, which caps how many loaded records can pile
+up ahead of a slow consumer.
+
+Parsing in a process pool doesn't pay here, since the parsed record has to
+be pickled back to this process, which costs about as much as parsing it.
+Work that is CPU bound should instead go to processes which load and
+process whole files themselves and send back only their results, as
+validatehr --processes does.
+
+    >>> for path, record in load_records("records/**/*.json"):
+    ...     if isinstance(record, Exception):
+    ...         print("could not load {}: {}".format(path, record))
+"""
+
+
+def expand_paths(paths):
+    """
+    yields file paths from [paths], expanding glob patterns lazily
+
+    __Args__
+
+    1. paths (str or iterable): a glob pattern, a path, or an iterable of
+    either. "**" matches any number of directories.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for x in paths:
+        if any(c in x for c in "*?[") and not exists(x):
+            for y in iglob(x, recursive=True):
+                yield y
+        else:
+            yield x
+
+
+def _record_from_data(data):
+    record = HierarchicalRecord()
+    record.set_data(data)
+    return record
+
+
+class RecordLoader(object):
+    """
+    Owns the thread pool used to load records. One loader can serve many
+    calls to load(), and should be closed (or used as a context manager)
+    when done with.
+    """
+
+    def __init__(self, threads=16, prefetch=None):
+        """
+        __KWArgs__
+
+        * threads (int): the number of threads reading files
+        * prefetch (int): the most files read or parsed ahead of the
+        consumer. Defaults to four per thread
+        """
+        if threads < 1:
+            raise ValueError("threads must be at least 1")
+        self.threads = threads
+        if prefetch is None:
+            prefetch = threads * 4
+        self.prefetch = max(prefetch, 1)
+        self._thread_pool = ThreadPoolExecutor(max_workers=threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._thread_pool.shutdown(wait=True)
+
+    def _load_one(self, path):
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            return (path, _record_from_data(loads(content)))
+        except Exception as e:
+            return (path, e)
+
+    def load(self, paths, ordered=True):
+        """
+        yields (path, HierarchicalRecord) for each file in [paths]. A file
+        which can not be read or is not a record yields (path, exception)
+        instead.
+
+        __Args__
+
+        1. paths (str or iterable): see expand_paths()
+
+        __KWArgs__
+
+        * ordered (bool): yield in the order of [paths]. If False, yield
+        each record as soon as it is loaded
+        """
+        paths = expand_paths(paths)
+        in_flight = deque()
+        for path in paths:
+            if len(in_flight) >= self.prefetch:
+                if ordered:
+                    yield in_flight.popleft().result()
+                else:
+                    done, pending = wait(in_flight,
+                                         return_when=FIRST_COMPLETED)
+                    for x in done:
+                        in_flight.remove(x)
+                        yield x.result()
+            in_flight.append(self._thread_pool.submit(self._load_one, path))
+        if ordered:
+            while in_flight:
+                yield in_flight.popleft().result()
+        else:
+            while in_flight:
+                done, pending = wait(in_flight, return_when=FIRST_COMPLETED)
+                for x in done:
+                    in_flight.remove(x)
+                    yield x.result()
+
+
+def load_records(paths, ordered=True, threads=16, prefetch=None):
+    """
+    yields (path, HierarchicalRecord or exception) for each file in
+    [paths], using a RecordLoader which is closed when the generator is.
+    See RecordLoader for the keyword arguments.
+
+    __Args__
+
+    1. paths (str or iterable): see expand_paths()
+    """
+    with RecordLoader(threads=threads, prefetch=prefetch) as loader:
+        for x in loader.load(paths, ordered=ordered):
+            yield x
@@ -0,0 +1,111 @@
+from hashlib import sha256
+from os import getpid, remove, replace
+from json import dumps, loads
+
+from hierarchicalrecord.confregistry import conf_from_bytes
+from hierarchicalrecord.recordconf import RecordConf
+from hierarchicalrecord.recordvalidator import RecordValidator
+
+"""
+Caches compiled RecordValidators on disk, next to the conf they came from.
+
+Parsing a conf, generating its rule ids and compiling the validator is the
+bulk of what a short lived process like validatehr does before it gets to
+its first record. load_validator() does that work once per version of a
+conf file and saves the result to [conf].hrcache. Later calls only hash the
+conf file and read the cache, as long as the hash still matches.
+
+    >>> validator = load_validator("conf.csv")
+
+The cache is plain JSON: the conf's rules, with their ids, and the child
+fields found for each rule, which is the slow part of compiling a big conf.
+Everything else is rebuilt from the rules on load, so reading a cache never
+runs code from it. Someone able to write the cache can still change what
+the conf means, so it should be no more writable than the conf itself.
+
+A cache which is missing, stale, unreadable or was written by a different
+version of this module is simply rebuilt, and a cache which can't be
+written is skipped.
+"""
+
+
+# Bump whenever the layout of the cache changes
+_CACHE_FORMAT = 2
+_CACHE_EXTENSION = ".hrcache"
+
+
+def cache_path(conf_fp):
+    """
+    returns where the cache for [conf_fp] is kept
+
+    __Args__
+
+    1. conf_fp (str): the path to the conf file
+    """
+    return conf_fp + _CACHE_EXTENSION
+
+
+def _read_cache(cache_fp, digest):
+    try:
+        with open(cache_fp, "rb") as f:
+            cache = loads(f.read().decode("utf-8"))
+        if cache["format"] != _CACHE_FORMAT or cache["digest"] != digest:
+            return None
+        conf = RecordConf()
+        conf.data = cache["rules"]
+        suffixes = cache["suffixes"]
+        if len(suffixes) != len(conf.data) or \
+                not all(x is None or isinstance(x, list) for x in suffixes):
+            return None
+        validator = RecordValidator(conf)
+        validator._plan = validator._build_plan(suffixes=suffixes)
+    except Exception:
+        return None
+    return validator
+
+
+def _write_cache(cache_fp, digest, validator):
+    suffixes = [None if x.suffixes is None else list(x.suffixes)
+                for x in validator._get_plan().rules]
+    try:
+        content = dumps({"format": _CACHE_FORMAT, "digest": digest,
+                         "rules": validator.conf.data, "suffixes": suffixes})
+    except (TypeError, ValueError):
+        # A cache that can't be written is skipped, whatever the reason
+        return
+    tmp_fp = "{}.{}.tmp".format(cache_fp, getpid())
+    try:
+        with open(tmp_fp, "wb") as f:
+            f.write(content.encode("utf-8"))
+        replace(tmp_fp, cache_fp)
+    except OSError:
+        try:
+            remove(tmp_fp)
+        except OSError:
+            pass
+
+
+def load_validator(conf_fp, use_cache=True):
+    """
+    returns a compiled RecordValidator for a CSV or line JSON conf file
+    (see confregistry.conf_from_file()), from the cache if it is current
+
+    __Args__
+
+    1. conf_fp (str): the path to the conf file
+
+    __KWArgs__
+
+    * use_cache (bool): whether to read and write the cache at all
+    """
+    with open(conf_fp, "rb") as f:
+        content = f.read()
+    if use_cache:
+        digest = sha256(content).hexdigest()
+        validator = _read_cache(cache_path(conf_fp), digest)
+        if validator is not None:
+            return validator
+    validator = RecordValidator(conf_from_bytes(conf_fp, content)).compile()
+    if use_cache:
+        _write_cache(cache_path(conf_fp), digest, validator)
+    return validator
@@ -0,0 +1,252 @@
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+from hierarchicalrecord.recordconf import RecordConf
+
+"""
+Infers a RecordConf from a corpus of existing records.
+
+ConfProfiler makes a single pass over each record's data, keeping a fixed
+set of counters per generalized field, so memory depends only on how many
+distinct fields the corpus has. Profiles built over separate shards of a
+corpus, eg in parallel processes, can be merged before producing a conf.
+
+    >>> profiler = ConfProfiler()
+    >>> for record in records:
+    ...     profiler.add(record)
+    >>> profiler.to_conf().to_csv("inferred.csv")
+
+For each field the inferred conf records:
+
+* Value Type: the type of every non-empty value, when there is only one
+* Obligation: "r" if the field appeared in every instance of its parent,
+and the parent never held anything but nested dicts
+* Cardinality: the number of values, when every instance had the same number
+* Children Required: for nodes, the fewest distinct subfields any one had
+"""
+
+
+_TYPE_NAMES = ("str", "dict", "int", "bool", "float")
+
+
+class FieldProfile(object):
+    """
+    The counters kept for one generalized field.
+
+    __Attributes__
+
+    * name (str): the generalized field name
+    * present (int): how many parent instances held the field
+    * values (int): how many values the field held in total
+    * min_values (int): the fewest values in any one instance of the field
+    * max_values (int): the most values in any one instance of the field
+    * nones (int): how many of the values were None
+    * nodes (int): how many of the values were nested dicts
+    * min_children (int): the fewest subfields any one nested dict had
+    * max_children (int): the most subfields any one nested dict had
+    * types (dict): counts of the other values by type name
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.present = 0
+        self.values = 0
+        self.min_values = None
+        self.max_values = None
+        self.nones = 0
+        self.nodes = 0
+        self.min_children = None
+        self.max_children = None
+        self.types = {}
+
+    def merge(self, other):
+        self.present += other.present
+        self.values += other.values
+        self.nones += other.nones
+        self.nodes += other.nodes
+        self.min_values = _min(self.min_values, other.min_values)
+        self.max_values = _max(self.max_values, other.max_values)
+        self.min_children = _min(self.min_children, other.min_children)
+        self.max_children = _max(self.max_children, other.max_children)
+        for k, v in other.types.items():
+            self.types[k] = self.types.get(k, 0) + v
+
+    def value_type(self):
+        """returns the single Value Type every non-empty value had, or "" """
+        if self.nones:
+            # validate() type checks placeholder Nones too
+            return ""
+        types = set(self.types.keys())
+        if self.nodes:
+            types.add("dict")
+        if types == set(["int", "bool"]):
+            # bools pass an int check
+            types = set(["int"])
+        if len(types) != 1:
+            return ""
+        value_type = types.pop()
+        if value_type not in _TYPE_NAMES:
+            return ""
+        return value_type
+
+    def to_dict(self):
+        return {
+            "present": self.present,
+            "values": self.values,
+            "min_values": self.min_values,
+            "max_values": self.max_values,
+            "nones": self.nones,
+            "nodes": self.nodes,
+            "min_children": self.min_children,
+            "max_children": self.max_children,
+            "types": dict(self.types)
+        }
+
+
+def _min(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class ConfProfiler(object):
+    """
+    Streams records into per-field counters and turns them into a
+    RecordConf. See the module docstring for what is inferred.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self._fields = {}
+
+    def add(self, record):
+        """
+        profiles one record
+
+        __Args__
+
+        1. record (HierarchicalRecord or dict): the record, or its internal
+        dict
+        """
+        if not isinstance(record, HierarchicalRecord):
+            data = record
+            record = HierarchicalRecord()
+            record.set_data(data)
+        self.records += 1
+        fields = self._fields
+        for key, path, values in record.walk(fields=True):
+            profile = fields.get(path)
+            if profile is None:
+                profile = FieldProfile(path)
+                fields[path] = profile
+            n = len(values)
+            profile.present += 1
+            profile.values += n
+            if profile.min_values is None or n < profile.min_values:
+                profile.min_values = n
+            if profile.max_values is None or n > profile.max_values:
+                profile.max_values = n
+            for value in values:
+                if isinstance(value, dict):
+                    profile.nodes += 1
+                    n = len(value)
+                    if profile.min_children is None or \
+                            n < profile.min_children:
+                        profile.min_children = n
+                    if profile.max_children is None or \
+                            n > profile.max_children:
+                        profile.max_children = n
+                elif value is None:
+                    profile.nones += 1
+                else:
+                    type_name = type(value).__name__
+                    profile.types[type_name] = \
+                        profile.types.get(type_name, 0) + 1
+
+    def add_many(self, records):
+        for x in records:
+            self.add(x)
+
+    def merge(self, other):
+        """
+        folds another profiler's counts, eg from a parallel shard, into
+        this one
+
+        __Args__
+
+        1. other (ConfProfiler): the profiler to fold in
+        """
+        self.records += other.records
+        for name, profile in other._fields.items():
+            mine = self._fields.get(name)
+            if mine is None:
+                mine = FieldProfile(name)
+                self._fields[name] = mine
+            mine.merge(profile)
+        return self
+
+    def fields(self):
+        """returns the FieldProfiles, in the order fields were first seen"""
+        return list(self._fields.values())
+
+    def get_field(self, name):
+        return self._fields[name]
+
+    def _parent_instances(self, profile):
+        if "." not in profile.name:
+            return self.records
+        parent = self._fields[profile.name.rsplit(".", 1)[0]]
+        return parent.nodes
+
+    def _rule(self, profile):
+        required = profile.present == self._parent_instances(profile)
+        parent = None
+        if "." in profile.name:
+            parent = self._fields[profile.name.rsplit(".", 1)[0]]
+            # validate() looks for a required nested field in every value
+            # of the parent, and a None or scalar one either raises or
+            # seems to lack it
+            if parent.nones or parent.types:
+                required = False
+        cardinality = "n"
+        if profile.min_values == profile.max_values:
+            cardinality = str(profile.max_values)
+            # validate() checks a nested cardinality in every instance
+            # of the parent, and fails on any that lack the field
+            if parent is not None and \
+                    (not required or parent.nones or parent.types):
+                cardinality = "n"
+        children_required = ""
+        if profile.nodes and profile.min_children and \
+                not profile.nones and not profile.types:
+            children_required = str(profile.min_children)
+        return {
+            "Field Name": profile.name,
+            "Value Type": profile.value_type(),
+            "Obligation": "r" if required else "o",
+            "Cardinality": cardinality,
+            "Validation": "",
+            "Children Required": children_required
+        }
+
+    def to_conf(self):
+        """returns a RecordConf describing the records profiled so far"""
+        conf = RecordConf()
+        for profile in self._fields.values():
+            conf.add_rule(self._rule(profile))
+        return conf
+
+    def to_dict(self):
+        """returns the raw counters as a JSON serializable dict"""
+        return {
+            "records": self.records,
+            "fields": dict((k, v.to_dict()) for k, v in self._fields.items())
+        }
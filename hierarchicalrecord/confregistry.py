@@ -0,0 +1,327 @@
+from hashlib import sha256
+from io import StringIO
+from itertools import count
+from json import dumps
+from os import stat
+from threading import Event, Lock, Thread
+from time import time
+
+from hierarchicalrecord.recordconf import RecordConf
+from hierarchicalrecord.recordvalidator import RecordValidator
+
+"""
+A registry of named RecordConfs for long running processes.
+
+Each conf is parsed and compiled once into an immutable ConfVersion. The
+registry can watch the files the confs came from, and when one changes it
+builds a new version off to the side and swaps it in with a single
+assignment. Validations already running keep the version they started
+with, and every result says which version produced it.
+"""
+
+
+_JSON_EXTENSIONS = (".json", ".jsonl", ".ndjson")
+
+
+class UnknownConfError(KeyError):
+    """raised when a name has no conf registered under it"""
+    pass
+
+
+def conf_from_file(conf_fp):
+    """
+    reads a RecordConf from a file, choosing the format by extension.
+    .json, .jsonl and .ndjson files are read with RecordConf.from_json(),
+    anything else with RecordConf.from_csv()
+
+    __Args__
+
+    1. conf_fp (str): the path to the conf file
+    """
+    conf = RecordConf()
+    if conf_fp.lower().endswith(_JSON_EXTENSIONS):
+        conf.from_json(conf_fp)
+    else:
+        conf.from_csv(conf_fp)
+    return conf
+
+
+def conf_from_bytes(conf_fp, content):
+    """
+    parses a RecordConf from the already read content of a conf file,
+    choosing the format by extension as conf_from_file() does
+
+    __Args__
+
+    1. conf_fp (str): the path the content was read from
+    2. content (bytes): the file's content
+    """
+    conf = RecordConf()
+    f = StringIO(content.decode("utf-8"), newline="")
+    if conf_fp.lower().endswith(_JSON_EXTENSIONS):
+        conf.read_json(f)
+    else:
+        conf.read_csv(f)
+    return conf
+
+
+class ConfVersion(object):
+    """
+    One immutable, compiled version of a named conf.
+
+    __Attributes__
+
+    * name (str): the name the conf is registered under
+    * version (int): increases every time any conf in the process is
+    (re)loaded, so (name, version) never repeats
+    * digest (str): the sha256 of the conf's source
+    * path (str): the file the conf was read from, or None
+    * conf (RecordConf): the parsed conf
+    * validator (RecordValidator): a compiled validator for the conf
+    * loaded_at (float): when the version was built, as a unix timestamp
+
+    Raises ValueError for a conf with a malformed cell (eg an unknown Value
+    Type or a Validation regex which doesn't compile), which a registry
+    treats as a failed load rather than putting it live.
+    """
+
+    def __init__(self, name, version, digest, conf, path=None):
+        self.name = name
+        self.version = version
+        self.digest = digest
+        self.path = path
+        self.conf = conf
+        self.validator = RecordValidator(conf).compile()
+        for rule in self.validator._plan.rules:
+            if rule.error is not None:
+                problem = type(rule.error).__name__
+                if str(rule.error):
+                    problem += ": " + str(rule.error)
+                raise ValueError("The rule for {} in conf {} is malformed "
+                                 "({})".format(rule.field_name, name,
+                                               problem))
+        self.loaded_at = time()
+        self._stat = None
+
+    def __repr__(self):
+        return "<ConfVersion {}@{} {}>".format(self.name, self.version,
+                                               self.digest[:12])
+
+    def tag(self):
+        """returns a short string identifying this version"""
+        return "{}@{}:{}".format(self.name, self.version, self.digest[:12])
+
+    def validate(self, record, strict=True, missing_is_error=True,
+                 structured=False):
+        """
+        validates [record], returning RecordValidator.validate()'s
+        (valid, errors) tuple with this version appended
+
+        __Args__
+
+        1. record (HierarchicalRecord): the record to validate
+
+        __KWArgs__
+
+        * strict (bool): see RecordValidator.validate()
+        * missing_is_error (bool): see RecordValidator.validate()
+        * structured (bool): see RecordValidator.validate()
+        """
+        valid, errors = self.validator.validate(
+            record, strict=strict, missing_is_error=missing_is_error,
+            structured=structured)
+        return (valid, errors, self)
+
+
+class ConfRegistry(object):
+    """
+    Loads named confs once, keeps their compiled forms, and optionally
+    watches their files, atomically swapping in new versions as they change.
+    """
+
+    _versions = count(1)
+
+    def __init__(self, poll_interval=1.0, on_swap=None, on_error=None):
+        """
+        __KWArgs__
+
+        * poll_interval (float): seconds between checks of watched files
+        * on_swap (callable): called as on_swap(old, new) after a conf is
+        replaced. [old] is None for a conf's first version
+        * on_error (callable): called as on_error(name, exception) when a
+        changed file fails to load. The previous version stays current
+        """
+        self.poll_interval = poll_interval
+        self.on_swap = on_swap
+        self.on_error = on_error
+        self._current = {}
+        self._failed = {}
+        self._lock = Lock()
+        self._stop = None
+        self._watcher = None
+
+    def __contains__(self, name):
+        return name in self._current
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def names(self):
+        return sorted(self._current.keys())
+
+    def get(self, name):
+        """
+        returns the current ConfVersion registered under [name]
+
+        __Args__
+
+        1. name (str): the name of the conf
+        """
+        try:
+            return self._current[name]
+        except KeyError:
+            raise UnknownConfError(name)
+
+    def _swap(self, new):
+        with self._lock:
+            old = self._current.get(new.name)
+            self._current[new.name] = new
+        if self.on_swap is not None:
+            self.on_swap(old, new)
+        return new
+
+    def add(self, name, conf):
+        """
+        registers an in-memory conf under [name]. Confs added this way are
+        not watched.
+
+        __Args__
+
+        1. name (str): the name of the conf
+        2. conf (RecordConf): the conf
+        """
+        digest = sha256(dumps(conf.data, sort_keys=True).encode("utf-8"))
+        return self._swap(ConfVersion(name, next(self._versions),
+                                      digest.hexdigest(), conf))
+
+    def _build_from_file(self, name, conf_fp):
+        st = stat(conf_fp)
+        with open(conf_fp, "rb") as f:
+            content = f.read()
+        digest = sha256(content).hexdigest()
+        current = self._current.get(name)
+        if current is not None and current.path == conf_fp and \
+                current.digest == digest:
+            current._stat = (st.st_mtime_ns, st.st_size)
+            return None
+        conf = conf_from_bytes(conf_fp, content)
+        new = ConfVersion(name, next(self._versions), digest, conf,
+                          path=conf_fp)
+        new._stat = (st.st_mtime_ns, st.st_size)
+        return new
+
+    def load(self, name, conf_fp):
+        """
+        reads a CSV or line JSON conf file (see conf_from_file()) and
+        registers it under [name]. If the file's content is unchanged from
+        the current version, that version is kept.
+
+        __Args__
+
+        1. name (str): the name of the conf
+        2. conf_fp (str): the path to the conf file
+        """
+        new = self._build_from_file(name, conf_fp)
+        if new is None:
+            return self._current[name]
+        return self._swap(new)
+
+    def remove(self, name):
+        with self._lock:
+            del self._current[name]
+
+    def reload(self, name=None):
+        """
+        reloads the file backed confs whose files have changed since they
+        were read, and returns the list of new versions. A conf which fails
+        to load keeps its current version and is reported to on_error, or
+        raised if there is no on_error.
+
+        __KWArgs__
+
+        * name (str): only check this conf. Defaults to every conf
+        """
+        if name is None:
+            names = list(self._current.keys())
+        else:
+            names = [name]
+        swapped = []
+        for x in names:
+            current = self._current.get(x)
+            if current is None or current.path is None:
+                continue
+            st = None
+            try:
+                st = stat(current.path)
+                st = (st.st_mtime_ns, st.st_size)
+                if st == current._stat or st == self._failed.get(x):
+                    continue
+                new = self._build_from_file(x, current.path)
+            except Exception as e:
+                # Don't report the same broken file on every poll
+                self._failed[x] = st
+                if self.on_error is None:
+                    raise
+                self.on_error(x, e)
+                continue
+            self._failed.pop(x, None)
+            if new is not None:
+                swapped.append(self._swap(new))
+        return swapped
+
+    def validate(self, name, record, strict=True, missing_is_error=True,
+                 structured=False):
+        """
+        validates [record] against the current version of a conf, returning
+        (valid, errors, ConfVersion)
+
+        __Args__
+
+        1. name (str): the name of the conf
+        2. record (HierarchicalRecord): the record to validate
+
+        __KWArgs__
+
+        * strict (bool): see RecordValidator.validate()
+        * missing_is_error (bool): see RecordValidator.validate()
+        * structured (bool): see RecordValidator.validate()
+        """
+        return self.get(name).validate(record, strict=strict,
+                                       missing_is_error=missing_is_error,
+                                       structured=structured)
+
+    def _watch(self, stop):
+        while not stop.wait(self.poll_interval):
+            try:
+                self.reload()
+            except Exception:
+                # Without an on_error the failure would kill the thread,
+                # keep watching and retry on the next poll instead
+                pass
+
+    def start_watching(self):
+        """starts a daemon thread which polls the conf files for changes"""
+        if self._watcher is not None:
+            return
+        self._stop = Event()
+        self._watcher = Thread(target=self._watch, args=(self._stop,),
+                               name="ConfRegistry watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
+        self._stop = None
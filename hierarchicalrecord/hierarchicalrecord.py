@@ -22,6 +22,11 @@ class HierarchicalRecord(object):
 
     _TRAILING_DIGITS_REGEX = regex_compile(r'\d+$')
 
+    # None while this record's containers are its own. Once the record has
+    # been cloned, maps id() to each container it has copied since and so
+    # may write to in place; every other container may be shared.
+    _owned = None
+
     def __init__(self, from_file=None):
         """
         Initializes a new HierarchicalRecord instance. If a JSON file is
@@ -460,6 +465,97 @@ class HierarchicalRecord(object):
             return self._check_if_field_exists(keyList[1:],
                                                start=start[new_key_str][new_key_index])
 
+    def _own(self, container):
+        """
+        returns a copy of [container] this record may write to, or
+        [container] itself if it already is one
+
+        __Args__
+
+        1. container (dict or list): a container in the data structure
+        """
+        if id(container) in self._owned:
+            return container
+        container = container.copy()
+        self._owned[id(container)] = container
+        return container
+
+    def _own_path(self, keyList):
+        """
+        copies the containers from the root along the location specified by
+        the key list which this record may share with a clone, so that a
+        write there is seen by this record alone. Does nothing for records
+        which have never been cloned.
+
+        __Args__
+
+        1. keyList (list): A list of key segments from a split dotted key syntax
+        string
+        """
+        if self._owned is None:
+            return
+        node = self._own(self.data)
+        self.data = node
+        for i, x in enumerate(keyList):
+            new_key_str, new_key_index = self._split_path_strings(x)
+            if new_key_str not in node or \
+                    not isinstance(node[new_key_str], list):
+                return
+            field = self._own(node[new_key_str])
+            node[new_key_str] = field
+            if new_key_index is None or i == len(keyList)-1:
+                return
+            if new_key_index > len(field)-1:
+                return
+            if field[new_key_index] is None:
+                # The *_from_key_list methods treat a start of None as the
+                # root, so a walk through a None value carries on from there
+                node = self.data
+                continue
+            if not isinstance(field[new_key_index], dict):
+                return
+            node = self._own(field[new_key_index])
+            field[new_key_index] = node
+
+    def clone(self):
+        """
+        returns a new HierarchicalRecord with the same contents in constant
+        time. The two records share their data until one of them is
+        written to, at which point the writer copies only the containers
+        on the path from the root to the edited location.
+
+        Writes must go through the record's own methods for this to hold:
+        mutating the lists and dicts returned by get_data(), get_field() or
+        a dict valued get_value() edits every record sharing them.
+        """
+        clone = self.__class__()
+        clone.data = self.data
+        clone._owned = {}
+        self._owned = {}
+        return clone
+
+    def snapshot(self):
+        """
+        returns a clone of the record as it is now, for use with restore(),
+        eg to cheaply undo later edits
+        """
+        return self.clone()
+
+    def restore(self, snapshot):
+        """
+        returns the record to the state captured by snapshot(). The
+        snapshot is left unchanged and can be restored again.
+
+        __Args__
+
+        1. snapshot (HierarchicalRecord): a snapshot of this or any record
+        """
+        if not isinstance(snapshot, HierarchicalRecord):
+            raise ValueError("Not a HierarchicalRecord")
+        self.data = snapshot.data
+        self._owned = {}
+        snapshot._owned = {}
+
     def set_data(self, data):
         """
         sets the internal dictionary attribute
@@ -471,6 +567,7 @@ class HierarchicalRecord(object):
         if not isinstance(data, dict):
             raise ValueError
         self.data = data
+        self._owned = None
 
     def get_data(self):
         """returns the internal dictionary attribute"""
@@ -493,6 +590,7 @@ class HierarchicalRecord(object):
         if not isinstance(key, list):
             raise ValueError()
         self._reqs_indices(key)
+        self._own_path(key)
         if not self._check_if_value_exists(key):
             self._init_field_from_key_list(key)
         self._set_value_from_key_list(key, value)
@@ -533,6 +631,7 @@ class HierarchicalRecord(object):
         self._no_leaf_index(key)
         if not isinstance(value, list) or len(value) < 1:
             raise ValueError("Fields can only be initialized to lists with at least one element")
+        self._own_path(key)
         if not self._check_if_field_exists(key):
             self._init_field_from_key_list(key)
         self._set_field_from_key_list(key, value)
@@ -577,6 +676,7 @@ class HierarchicalRecord(object):
             raise ValueError()
         self._no_leaf_index(key)
         if self._check_if_field_exists(key):
+            self._own_path(key)
             self._add_to_field_from_key_list(key, value)
         else:
             if not create_if_necessary:
@@ -600,6 +700,7 @@ class HierarchicalRecord(object):
             raise ValueError()
         self._reqs_indices(key)
         if self._check_if_value_exists(key):
+            self._own_path(key)
             self._del_value_from_key_list(key)
         else:
             raise KeyError(key)
@@ -619,10 +720,106 @@ class HierarchicalRecord(object):
             raise ValueError()
         self._no_leaf_index(key)
         if self._check_if_field_exists(key):
+            self._own_path(key)
             self._del_field_from_key_list(key)
         else:
             raise KeyError(key)
 
+    def remove_many(self, keys):
+        """
+        removes the values at all of [keys], which are taken to address the
+        record as it was before any of them were removed. Removing a value
+        removes everything beneath it. Each field affected is rebuilt once,
+        and a field left empty is deleted, as remove_value() does. If any
+        key does not exist a KeyError is raised and nothing is removed.
+
+        __Args__
+
+        1. keys (iterable): keys in dotted key syntax as strings, or split
+        into their parts in lists
+        """
+        key_lists = []
+        for key in keys:
+            if isinstance(key, str):
+                key = self._dotted_to_list(key)
+            if not isinstance(key, list):
+                raise ValueError()
+            self._reqs_indices(key)
+            if not self._check_if_value_exists(key):
+                raise KeyError(key)
+            key_lists.append(key)
+        for key in key_lists:
+            self._own_path(key)
+        # id(field) -> (the dict holding it, its name, indices to remove)
+        removals = {}
+        for key in key_lists:
+            parent = None
+            if len(key) > 1:
+                parent = self._get_value_from_key_list(key[:-1])
+            if parent is None:
+                # as in the *_from_key_list methods
+                parent = self.get_data()
+            new_key_str, new_key_index = self._split_path_strings(key[-1])
+            field = parent[new_key_str]
+            if id(field) not in removals:
+                removals[id(field)] = (parent, new_key_str, set())
+            removals[id(field)][2].add(new_key_index)
+        for parent, new_key_str, indices in removals.values():
+            field = parent[new_key_str]
+            field[:] = [x for i, x in enumerate(field) if i not in indices]
+            if len(field) == 0:
+                del parent[new_key_str]
+
+    def _retain_node(self, node, predicate, init_path):
+        """
+        removes the values beneath [node] which [predicate] rejects,
+        returning [node] or, if anything beneath it changed while it was
+        shared, the copy which was changed
+        """
+        result = node
+        for x in list(node):
+            field = node[x]
+            new_values = []
+            changed = False
+            for i, y in enumerate(field):
+                if init_path is None:
+                    path = x + str(i)
+                else:
+                    path = init_path + "." + x + str(i)
+                if not predicate(path, y):
+                    changed = True
+                    continue
+                if isinstance(y, dict):
+                    new_y = self._retain_node(y, predicate, path)
+                    if new_y is not y:
+                        changed = True
+                    y = new_y
+                new_values.append(y)
+            if not changed:
+                continue
+            if self._owned is not None:
+                result = self._own(result)
+                field = self._own(field)
+                result[x] = field
+            field[:] = new_values
+            if len(field) == 0:
+                del result[x]
+        return result
+
+    def retain(self, predicate):
+        """
+        keeps only the values [predicate] accepts, in a single walk of the
+        record. A rejected value is removed along with everything beneath
+        it, and a field left empty is deleted, as remove_value() does.
+
+        __Args__
+
+        1. predicate (callable): called as predicate(key, value) for each
+        value, parents before their children, with keys as keys() gives
+        them before anything is removed. Returns True to keep the value
+        """
+        self.data = self._retain_node(self.data, predicate, None)
+
     def leaves(self, start=None, init_path=None):
         """
         returns a list of tuples of all the leaf values in the data structure
@@ -649,6 +846,87 @@ class HierarchicalRecord(object):
                     result = result + self.leaves(start=y, init_path=path)
         return result
 
+    def _map_node(self, node, fn, drop, targets, ancestors, init_path,
+                  changes):
+        """
+        maps the leaves beneath [node], returning [node] or, if anything
+        beneath it changed while it was shared, the copy which was changed
+        """
+        result = node
+        for x in list(node):
+            if init_path is None:
+                path = x
+            else:
+                path = init_path + "." + x
+            if targets is None or path in targets:
+                sub_targets = None
+            elif path in ancestors:
+                sub_targets = targets
+            else:
+                continue
+            field = node[x]
+            new_values = []
+            changed = False
+            for y in field:
+                if isinstance(y, dict):
+                    new_y = self._map_node(y, fn, drop, sub_targets,
+                                           ancestors, path, changes)
+                elif sub_targets is None:
+                    new_y = fn(y)
+                    if drop is not None and drop(new_y):
+                        changes[0] += 1
+                        changed = True
+                        continue
+                    if new_y is not y:
+                        changes[0] += 1
+                else:
+                    # a leaf above the fields being mapped
+                    new_y = y
+                if new_y is not y:
+                    changed = True
+                new_values.append(new_y)
+            if not changed:
+                continue
+            if self._owned is not None:
+                result = self._own(result)
+                field = self._own(field)
+                result[x] = field
+            field[:] = new_values
+            if len(field) == 0:
+                del result[x]
+        return result
+
+    def map_leaves(self, fn, where=None, drop=None):
+        """
+        replaces every leaf value with fn(value), in place, in a single
+        walk of the record. Equivalent to, but much faster than,
+        setting hr[key] = fn(value) for each (key, value) in hr.leaves()
+
+        __Args__
+
+        1. fn (callable): called with each leaf value, returns its new value
+
+        __KWArgs__
+
+        * where (str or list): generalized field names, eg creator.name.
+        Only leaves in or beneath these fields are mapped, and other
+        subtrees are not walked at all
+        * drop (callable): called with each new value. Leaves it returns
+        True for are removed, and their fields compacted, as if by
+        remove_value()
+
+        returns the number of leaves replaced with a different object or
+        dropped
+        """
+        targets, ancestors = _leaf_filter(where)
+        return self._map_leaves(fn, drop, targets, ancestors)
+
+    def _map_leaves(self, fn, drop, targets, ancestors):
+        changes = [0]
+        self.data = self._map_node(self.data, fn, drop, targets, ancestors,
+                                   None, changes)
+        return changes[0]
+
     def keys(self, start=None, init_path=None):
         """
         returns a list of all the keys in the tree.
@@ -673,6 +951,20 @@ class HierarchicalRecord(object):
                     result = result + self.keys(start=y, init_path=path)
         return result
 
+    def walk(self, fields=False):
+        """
+        yields (key, generalized key, value) for every key in the tree, in
+        the order of keys(), without building a list. The generalized keys
+        are those generalize_key() gives.
+
+        __KWArgs__
+
+        * fields (bool): instead yield (key, generalized key, values) once
+        for each field, keyed without its index (eg "a0.b"), ahead of
+        the fields inside its values
+        """
+        return _walk(self.get_data(), None, None, fields)
+
     def values(self):
         """
         returns a list of all the values in the tree.
@@ -702,3 +994,77 @@ class HierarchicalRecord(object):
         """
         with open(json_file, 'r') as f:
             self.data = load(f, **kwargs)
+        self._owned = None
+
+
+def _leaf_filter(where):
+    """
+    returns the generalized field names [where] selects, and those of the
+    fields which lead to them, or (None, None) to select everything
+    """
+    if where is None:
+        return None, None
+    if isinstance(where, str):
+        where = [where]
+    targets = set(where)
+    ancestors = set()
+    for x in targets:
+        segments = x.split(".")
+        for i in range(1, len(segments)):
+            ancestors.add(".".join(segments[:i]))
+    return targets, ancestors
+
+
+def map_leaves(records, fn, where=None, drop=None):
+    """
+    calls HierarchicalRecord.map_leaves() on each of [records], preparing
+    [where] only once. See that method for the other arguments
+
+    __Args__
+
+    1. records (iterable): HierarchicalRecords, changed in place
+
+    returns the total number of leaves replaced or dropped
+    """
+    targets, ancestors = _leaf_filter(where)
+    changes = 0
+    for x in records:
+        changes += x._map_leaves(fn, drop, targets, ancestors)
+    return changes
+
+
+_GENERALIZE_REGEX = regex_compile(r'[0-9]+(?=\.|$)')
+
+
+def generalize_key(key):
+    """
+    returns [key] without its indices, eg "a0.b12" becomes "a.b"
+
+    __Args__
+
+    1. key (str): a dotted key
+    """
+    return _GENERALIZE_REGEX.sub("", key)
+
+
+def _walk(node, init_path, init_generalized, fields):
+    for x in node:
+        # Builds what generalize_key() would give a step at a time, which
+        # drops trailing digits from field names as well as the indices
+        name = x.rstrip("0123456789") if x[-1:].isdigit() else x
+        if init_path is None:
+            key = x
+            generalized = name
+        else:
+            key = init_path + "." + x
+            generalized = init_generalized + "." + name
+        values = node[x]
+        if fields:
+            yield (key, generalized, values)
+        for i, y in enumerate(values):
+            path = key + str(i)
+            if not fields:
+                yield (path, generalized, y)
+            if isinstance(y, dict):
+                for z in _walk(y, path, generalized, fields):
+                    yield z
@@ -0,0 +1,311 @@
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+from hierarchicalrecord.recordvalidator import RecordValidator
+
+"""
+RecordBuilder constructs HierarchicalRecords which conform to a RecordConf.
+
+Rather than growing a record one set_value() at a time and validating it
+afterwards, a builder lays out the skeleton the conf calls for up front:
+every required field, and every field with a fixed cardinality once it
+appears, is allocated at its declared size. Values are type and regex
+checked as they are inserted. Fields with subfields only get their final
+value once the record is done, so build() checks their Value Type and
+Validation, along with confirming that no allocated slot was left empty,
+that nodes have their required children, and that a nested field with a
+fixed cardinality is set in every instance of its parent if it is set in
+any. As long as the conf has a rule for every field with subfields, a
+record build() returns passes RecordValidator.validate().
+
+Setters take the generalized field name from the conf and one index per
+level of nesting, eg:
+
+    >>> b = RecordBuilder(conf)
+    >>> b.set("title", "A Title", 0)
+    >>> b.set("creator.name", "Someone", 0, 0)
+    >>> hr = b.build()
+"""
+
+
+# Marks a slot which has been allocated but not set. None is a value like
+# any other
+_UNSET = object()
+
+
+class _FieldSpec(object):
+    """what the conf says about one generalized field name"""
+
+    def __init__(self, name):
+        self.name = name
+        self.segments = name.split(".")
+        self.chain = []
+        self.rules = []
+        self.required = False
+        self.cardinality = None
+        self.types = []
+        self.matchers = []
+        self.req_children = []
+        self.children = []
+
+    def key(self, indices):
+        return ".".join([x + str(y) for x, y in zip(self.segments, indices)])
+
+    def check(self, value, indices):
+        for comp_type, type_name in self.types:
+            if not isinstance(value, comp_type):
+                raise ValueError(
+                    ("{} contains the wrong value type. Type should be {}, " +
+                     "is {}").format(self.key(indices), type_name,
+                                     str(type(value))))
+        for matcher in self.matchers:
+            if not matcher.match(str(value)):
+                raise ValueError("Value for {} does not match its "
+                                 "validation".format(self.key(indices)))
+
+
+class RecordBuilder(object):
+    """
+    Builds one record at a time against a RecordConf. See the module
+    docstring for an example.
+    """
+
+    def __init__(self, conf):
+        """
+        __Args__
+
+        1. conf (RecordConf): the conf records must conform to
+        """
+        plan = RecordValidator(conf).compile()._get_plan()
+        self._specs = {}
+        for rule in plan.rules:
+            if rule.error is not None:
+                raise rule.error
+            spec = self._get_spec(rule.field_name)
+            spec.rules.append(rule.rule)
+            spec.required = spec.required or rule.required
+            if rule.cardinality is not None:
+                if spec.cardinality is not None and \
+                        spec.cardinality != rule.cardinality:
+                    raise ValueError("Conflicting cardinalities for " +
+                                     "{}".format(rule.field_name))
+                spec.cardinality = rule.cardinality
+            if rule.comp_type is not None:
+                spec.types.append((rule.comp_type, rule.value_type))
+            if rule.matcher is not None:
+                spec.matchers.append(rule.matcher)
+            if rule.req_children is not None:
+                spec.req_children.append((rule.req_children, rule.suffixes))
+        for spec in list(self._specs.values()):
+            for i in range(1, len(spec.segments)):
+                self._get_spec(".".join(spec.segments[:i]))
+        for name, spec in self._specs.items():
+            spec.chain = [self._specs[".".join(spec.segments[:i+1])]
+                          for i in range(len(spec.segments))]
+            if len(spec.segments) > 1:
+                parent = self._specs[".".join(spec.segments[:-1])]
+                parent.children.append(spec)
+        self._root = [x for x in self._specs.values() if
+                      len(x.segments) == 1]
+        self.reset()
+
+    def _get_spec(self, name):
+        spec = self._specs.get(name)
+        if spec is None:
+            spec = _FieldSpec(name)
+            self._specs[name] = spec
+        return spec
+
+    def _new_slot(self, spec):
+        if spec.children:
+            return self._new_node(spec.children)
+        return _UNSET
+
+    def _new_field(self, spec):
+        if spec.cardinality is not None:
+            return [self._new_slot(spec) for x in range(spec.cardinality)]
+        if spec.required:
+            return [self._new_slot(spec)]
+        return []
+
+    def _new_node(self, specs):
+        node = {}
+        for spec in specs:
+            if spec.required:
+                node[spec.segments[-1]] = self._new_field(spec)
+        return node
+
+    def reset(self):
+        """discards the record in progress and lays out a fresh skeleton"""
+        self._data = self._new_node(self._root)
+
+    def fields(self):
+        """returns the generalized field names the builder accepts"""
+        return sorted(self._specs.keys())
+
+    def set(self, field_name, value, *indices):
+        """
+        sets a value, checking it against the field's Value Type and
+        Validation first
+
+        __Args__
+
+        1. field_name (str): a generalized field name from the conf
+        2. value (any): the value to set
+        3. \*indices (int): one index per segment of [field_name]
+        """
+        self._set(self._leaf_spec(field_name), value, indices)
+
+    def _leaf_spec(self, field_name):
+        spec = self._specs[field_name]
+        if spec.children:
+            raise ValueError("{} has subfields, set those ".format(field_name) +
+                             "instead")
+        return spec
+
+    def _set(self, spec, value, indices):
+        if len(indices) != len(spec.segments):
+            raise ValueError("{} needs {} indices".format(
+                spec.name, len(spec.segments)))
+        spec.check(value, indices)
+        node = self._data
+        last = len(spec.chain) - 1
+        for depth, level in enumerate(spec.chain):
+            name = level.segments[-1]
+            index = indices[depth]
+            slots = node.get(name)
+            if slots is None:
+                slots = self._new_field(level)
+                node[name] = slots
+            if index >= len(slots):
+                if level.cardinality is not None:
+                    raise ValueError(
+                        "Key cardinality error: {} allows {} values".format(
+                            level.name, level.cardinality))
+                while len(slots) <= index:
+                    slots.append(self._new_slot(level) if depth < last
+                                 else _UNSET)
+            if depth == last:
+                slots[index] = value
+            else:
+                if slots[index] is _UNSET:
+                    slots[index] = self._new_node(level.children)
+                node = slots[index]
+
+    def setter(self, field_name):
+        """
+        returns a function equivalent to
+        lambda value, \*indices: self.set(field_name, value, \*indices)
+        with the field lookup done once
+
+        __Args__
+
+        1. field_name (str): a generalized field name from the conf
+        """
+        spec = self._leaf_spec(field_name)
+
+        def set_field_value(value, *indices):
+            self._set(spec, value, indices)
+        return set_field_value
+
+    def _walk(self, node, specs, path, indices, present, missing, invalid,
+              fixed):
+        for spec in specs:
+            name = spec.segments[-1]
+            if not node.get(name):
+                continue
+            present.add(spec.name)
+            for i, slot in enumerate(node[name]):
+                key = name + str(i)
+                if path is not None:
+                    key = path + "." + key
+                if slot is _UNSET:
+                    missing.append(key)
+                    continue
+                if not spec.children:
+                    # A value never has children
+                    if [x for x in spec.req_children if x[0] > 0]:
+                        invalid.append("Fewer than the required number of " +
+                                       "children in {}".format(key))
+                    continue
+                try:
+                    spec.check(slot, indices + [i])
+                except ValueError as e:
+                    invalid.append(str(e))
+                for req_children, suffixes in spec.req_children:
+                    present_children = len([x for x in suffixes if x in slot])
+                    if present_children < req_children:
+                        missing.append(key + "." + "|".join(suffixes))
+                if slot:
+                    for child in spec.children:
+                        if child.cardinality is not None and \
+                                child.segments[-1] not in slot:
+                            fixed.append((child, key))
+                self._walk(slot, spec.children, key, indices + [i], present,
+                           missing, invalid, fixed)
+
+    def _problems(self):
+        present = set()
+        missing = []
+        invalid = []
+        # (spec, parent key) for nested fields with a fixed cardinality
+        # absent from a parent. validate() needs them in every parent as
+        # soon as they are in one
+        fixed = []
+        self._walk(self._data, self._root, None, [], present, missing,
+                   invalid, fixed)
+        for spec, key in fixed:
+            if spec.name in present:
+                missing.extend([key + "." + spec.segments[-1] + str(x) for
+                                x in range(spec.cardinality)])
+        return missing, invalid
+
+    def missing(self):
+        """
+        returns the keys of allocated slots that have not been set, of
+        nodes without enough children, and of the values a fixed
+        cardinality field needs in a parent which lacks it, in the record
+        in progress
+        """
+        return self._problems()[0]
+
+    def _export(self, node, specs):
+        by_name = dict((x.segments[-1], x) for x in specs)
+        data = {}
+        for name, slots in node.items():
+            spec = by_name[name]
+            values = []
+            for x in slots:
+                if x is _UNSET:
+                    values.append(None)
+                elif spec.children:
+                    values.append(self._export(x, spec.children))
+                else:
+                    values.append(x)
+            data[name] = values
+        return data
+
+    def get_record(self):
+        """
+        returns a copy of the record in progress, without any completeness
+        check. Unset slots hold None
+        """
+        record = HierarchicalRecord()
+        record.set_data(self._export(self._data, self._root))
+        return record
+
+    def build(self):
+        """
+        returns the finished record and starts a fresh one. Raises a
+        ValueError naming the unset slots if the record is incomplete, or
+        the failed checks if a field with subfields is invalid
+        """
+        missing, invalid = self._problems()
+        if missing:
+            raise ValueError("Record is incomplete, missing: {}".format(
+                ", ".join(missing)))
+        if invalid:
+            raise ValueError("Record is invalid: {}".format(
+                "; ".join(invalid)))
+        record = HierarchicalRecord()
+        record.set_data(self._data)
+        self.reset()
+        return record
@@ -1,6 +1,12 @@
 from csv import DictReader, DictWriter
 from json import loads, dumps
-from uuid import uuid1
+
+
+def _new_rule_id():
+    # uuid is slow to import, and confs which carry their own ids never
+    # need it
+    from uuid import uuid1
+    return uuid1().hex
 
 
 class RecordConf(object):
@@ -23,10 +29,12 @@ class RecordConf(object):
         self._data = []
 
     def from_csv(self, csv_filepath):
-        rows = []
         with open(csv_filepath, 'r') as f:
-            reader = DictReader(f)
-            rows = [row for row in reader]
+            self.read_csv(f)
+
+    def read_csv(self, f):
+        reader = DictReader(f)
+        rows = [row for row in reader]
         for x in rows:
             self.add_rule(x)
 
@@ -39,8 +47,11 @@ class RecordConf(object):
 
     def from_json(self, json_filepath):
         with open(json_filepath, 'r') as f:
-            for line in f.readlines():
-                self.add_rule(loads(line.rstrip("\n")))
+            self.read_json(f)
+
+    def read_json(self, f):
+        for line in f.readlines():
+            self.add_rule(loads(line.rstrip("\n")))
 
     def to_json(self, json_filepath):
         with open(json_filepath, 'w') as f:
@@ -59,11 +70,11 @@ class RecordConf(object):
         rule_dict = {}
         for x in self._field_names:
             if (x == 'id' and 'id' not in rule):
-                rule_id = uuid1().hex
+                rule_id = _new_rule_id()
                 rule_dict['id'] = rule_id
                 continue
             if (x == 'id' and rule['id'] == ""):
-                rule_dict['id'] = uuid1().hex
+                rule_dict['id'] = _new_rule_id()
                 continue
             rule_dict[x] = rule[x]
         self.data.append(rule_dict)
@@ -0,0 +1,461 @@
+import sqlite3
+from contextlib import contextmanager
+from json import dumps, loads
+from re import compile as regex_compile, escape as regex_escape
+
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+
+"""
+A persistent store of HierarchicalRecords in a local SQLite database.
+
+Each record is saved as one row per key, in the form HierarchicalRecord.keys()
+produces it: the concrete dotted key, its generalized form (the key with
+its indices removed) and, for leaves, the value as JSON. Keys which hold a
+nested dict are stored as node rows without a value. Rows are indexed by
+(record id, key) and by generalized key, so single values, fields and
+subtrees can be read without loading the rest of the record, and every
+occurrence of a field across the store can be found directly.
+
+    >>> store = RecordStore("records.db")
+    >>> store.ingest((x, HierarchicalRecord(from_file=x)) for x in paths)
+    >>> store.get_value("rec1.json", "identifier0.value0")
+    >>> store["rec1.json"]["identifier0.value0"] = "new"
+
+Updates through the dotted key API read, modify and rewrite only the top
+level field the key falls under.
+
+Fields holding an empty list have no rows, so they are not preserved.
+"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    record_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    record_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    generalized TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    is_node INTEGER NOT NULL,
+    value TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS nodes_by_path
+    ON nodes (record_id, path);
+CREATE INDEX IF NOT EXISTS nodes_by_generalized
+    ON nodes (generalized, record_id);
+"""
+
+_TRAILING_DIGITS_REGEX = regex_compile(r'\d+$')
+
+
+def _rows(record_id, record):
+    for path, generalized, y in record.walk():
+        if isinstance(y, dict):
+            yield (record_id, path, generalized, path.count("."), 1, None)
+        else:
+            yield (record_id, path, generalized, path.count("."), 0,
+                   dumps(y))
+
+
+def _build(rows, strip=0):
+    """
+    builds a record's internal dict from (path, is_node, value) rows
+    ordered parents first. [strip] leading key segments are dropped from
+    every path, to rebuild a subtree.
+    """
+    data = {}
+    for path, is_node, value in rows:
+        segments = path.split(".")[strip:]
+        node = data
+        for segment in segments[:-1]:
+            name = _TRAILING_DIGITS_REGEX.sub("", segment)
+            node = node[name][int(segment[len(name):])]
+        name = _TRAILING_DIGITS_REGEX.sub("", segments[-1])
+        index = int(segments[-1][len(name):])
+        field = node.setdefault(name, [])
+        while len(field) <= index:
+            field.append(None)
+        field[index] = {} if is_node else loads(value)
+    return data
+
+
+def _stays_in_field(data, key):
+    """
+    whether every value on the way to [key] that exists is a dict, so that
+    acting on [key] can only touch the field it starts in
+    """
+    if isinstance(key, str):
+        key = key.split(".")
+    node = data
+    for segment in key[:-1]:
+        name = _TRAILING_DIGITS_REGEX.sub("", segment)
+        if name == segment or name not in node:
+            return True
+        index = int(segment[len(name):])
+        if index >= len(node[name]):
+            return True
+        node = node[name][index]
+        if not isinstance(node, dict):
+            return False
+    return True
+
+
+def _field_name(key):
+    if isinstance(key, list):
+        key = ".".join(key)
+    return _TRAILING_DIGITS_REGEX.sub("", key.split(".")[0])
+
+
+class RecordStore(object):
+    """
+    A SQLite database of HierarchicalRecords keyed by record id. See the
+    module docstring for the layout.
+    """
+
+    def __init__(self, db_path=":memory:"):
+        """
+        __KWArgs__
+
+        * db_path (str): the database file, created if necessary. Defaults
+        to a private in-memory database
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, isolation_level=None)
+        if db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._depth = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, record_id):
+        return self._conn.execute(
+            "SELECT 1 FROM records WHERE record_id = ?",
+            (record_id,)).fetchone() is not None
+
+    def __iter__(self):
+        for x in self.record_ids():
+            yield x
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def __getitem__(self, record_id):
+        """returns a StoredRecord view of a record, without loading it"""
+        if record_id not in self:
+            raise KeyError(record_id)
+        return StoredRecord(self, record_id)
+
+    def __delitem__(self, record_id):
+        self.delete(record_id)
+
+    def close(self):
+        self._conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        groups the writes made inside the block into one transaction.
+        Nested blocks join the outermost one.
+        """
+        if self._depth == 0:
+            self._conn.execute("BEGIN")
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("ROLLBACK")
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._conn.execute("COMMIT")
+
+    def record_ids(self):
+        return [x[0] for x in self._conn.execute(
+            "SELECT record_id FROM records ORDER BY record_id")]
+
+    def _delete_rows(self, record_id):
+        self._conn.execute("DELETE FROM nodes WHERE record_id = ?",
+                           (record_id,))
+
+    def put(self, record_id, record):
+        """
+        saves [record] under [record_id], replacing any record already
+        stored there
+
+        __Args__
+
+        1. record_id (str): the id to store the record under
+        2. record (HierarchicalRecord): the record
+        """
+        self.ingest([(record_id, record)])
+
+    def ingest(self, records):
+        """
+        saves many records in a single transaction. Either all of them are
+        stored or, if one fails, none are.
+
+        __Args__
+
+        1. records (iterable): (record id, HierarchicalRecord) pairs
+        """
+        with self.transaction():
+            for record_id, record in records:
+                self._delete_rows(record_id)
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO records (record_id) VALUES (?)",
+                    (record_id,))
+                self._conn.executemany(
+                    "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)",
+                    _rows(record_id, record))
+
+    def delete(self, record_id):
+        with self.transaction():
+            if record_id not in self:
+                raise KeyError(record_id)
+            self._delete_rows(record_id)
+            self._conn.execute("DELETE FROM records WHERE record_id = ?",
+                               (record_id,))
+
+    def get(self, record_id):
+        """
+        loads a whole record
+
+        __Args__
+
+        1. record_id (str): the id of the record
+        """
+        if record_id not in self:
+            raise KeyError(record_id)
+        record = HierarchicalRecord()
+        record.set_data(_build(self._conn.execute(
+            "SELECT path, is_node, value FROM nodes WHERE record_id = ? " +
+            "ORDER BY depth, rowid", (record_id,))))
+        return record
+
+    def _subtree_rows(self, record_id, key):
+        """rows strictly beneath the value at [key], parents first"""
+        return self._conn.execute(
+            "SELECT path, is_node, value FROM nodes WHERE record_id = ? " +
+            "AND path > ? AND path < ? ORDER BY depth, rowid",
+            (record_id, key + ".", key + "/"))
+
+    def _field_rows(self, record_id, key):
+        """the rows of the field [key] and beneath it, parents first"""
+        rows = self._conn.execute(
+            "SELECT path, is_node, value FROM nodes WHERE record_id = ? " +
+            "AND path >= ? AND path < ? ORDER BY depth, rowid",
+            (record_id, key + "0", key + ":"))
+        # The range also catches fields whose names continue with digits
+        # and letters, eg key1a0 for key
+        exact = regex_compile(regex_escape(key) + r'\d+(\.|$)')
+        return [x for x in rows if exact.match(x[0])]
+
+    def _crosses_leaf(self, record_id, key):
+        """
+        whether a key leading up to [key] holds a leaf value, in which case
+        HierarchicalRecord resolves the rest of [key] from the root
+        """
+        segments = key.split(".")
+        prefixes = [".".join(segments[:i+1])
+                    for i in range(len(segments) - 1)]
+        if not prefixes:
+            return False
+        return self._conn.execute(
+            "SELECT 1 FROM nodes WHERE record_id = ? AND is_node = 0 " +
+            "AND path IN ({})".format(", ".join("?" * len(prefixes))),
+            [record_id] + prefixes).fetchone() is not None
+
+    def get_value(self, record_id, key):
+        """
+        returns the value at [key] in a record. Nested dicts are rebuilt
+        from just their own rows.
+
+        __Args__
+
+        1. record_id (str): the id of the record
+        2. key (str): a key in dotted key syntax, ending in an index
+        """
+        row = self._conn.execute(
+            "SELECT is_node, value FROM nodes WHERE record_id = ? " +
+            "AND path = ?", (record_id, key)).fetchone()
+        if row is None:
+            if self._crosses_leaf(record_id, key):
+                return self.get(record_id).get_value(key)
+            raise KeyError(key)
+        if not row[0]:
+            return loads(row[1])
+        return _build(self._subtree_rows(record_id, key),
+                      strip=key.count(".") + 1)
+
+    def get_field(self, record_id, key):
+        """
+        returns the field at [key] in a record, as a list
+
+        __Args__
+
+        1. record_id (str): the id of the record
+        2. key (str): a key in dotted key syntax, not ending in an index
+        """
+        rows = self._field_rows(record_id, key)
+        if not rows:
+            if self._crosses_leaf(record_id, key):
+                return self.get(record_id).get_field(key)
+            raise KeyError(key)
+        strip = key.count(".")
+        return _build(rows, strip=strip)[key.split(".")[-1]]
+
+    def keys(self, record_id):
+        """
+        returns every key of a record. Fields rewritten by an update come
+        after the others, so the order can differ from the loaded record's
+        keys()
+        """
+        return [x[0] for x in self._conn.execute(
+            "SELECT path FROM nodes WHERE record_id = ? ORDER BY rowid",
+            (record_id,))]
+
+    def find(self, generalized, value=None):
+        """
+        yields (record id, key, value) for every leaf of a generalized
+        field across the store, optionally only where it equals [value]
+
+        __Args__
+
+        1. generalized (str): a generalized key, eg identifier.value
+
+        __KWArgs__
+
+        * value (any): a value to match exactly
+        """
+        if value is None:
+            rows = self._conn.execute(
+                "SELECT record_id, path, value FROM nodes " +
+                "WHERE generalized = ? AND is_node = 0", (generalized,))
+        else:
+            rows = self._conn.execute(
+                "SELECT record_id, path, value FROM nodes " +
+                "WHERE generalized = ? AND is_node = 0 AND value = ?",
+                (generalized, dumps(value)))
+        for record_id, path, x in rows:
+            yield (record_id, path, loads(x))
+
+    def _update(self, record_id, key, method, *args):
+        """
+        applies a HierarchicalRecord method to just the top level field
+        [key] falls under, and rewrites that field's rows
+        """
+        field = _field_name(key)
+        with self.transaction():
+            self._conn.execute(
+                "INSERT OR IGNORE INTO records (record_id) VALUES (?)",
+                (record_id,))
+            rows = self._field_rows(record_id, field)
+            partial = HierarchicalRecord()
+            partial.set_data(_build(rows))
+            if not _stays_in_field(partial.get_data(), key):
+                # HierarchicalRecord carries on from the root when a walk
+                # hits a value that isn't a dict, which may be any field
+                rows = self._conn.execute(
+                    "SELECT path, is_node, value FROM nodes " +
+                    "WHERE record_id = ? ORDER BY depth, rowid",
+                    (record_id,)).fetchall()
+                partial.set_data(_build(rows))
+            result = getattr(partial, method)(key, *args)
+            self._conn.executemany(
+                "DELETE FROM nodes WHERE record_id = ? AND path = ?",
+                [(record_id, x[0]) for x in rows])
+            self._conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)",
+                _rows(record_id, partial))
+        return result
+
+    def set_value(self, record_id, key, value):
+        """see HierarchicalRecord.set_value(). Creates the record if needed"""
+        self._update(record_id, key, "set_value", value)
+
+    def set_field(self, record_id, key, value):
+        """see HierarchicalRecord.set_field(). Creates the record if needed"""
+        self._update(record_id, key, "set_field", value)
+
+    def add_to_field(self, record_id, key, value, create_if_necessary=True):
+        """see HierarchicalRecord.add_to_field()"""
+        self._update(record_id, key, "add_to_field", value,
+                     create_if_necessary)
+
+    def remove_value(self, record_id, key):
+        """see HierarchicalRecord.remove_value()"""
+        self._update(record_id, key, "remove_value")
+
+    def remove_field(self, record_id, key):
+        """see HierarchicalRecord.remove_field()"""
+        self._update(record_id, key, "remove_field")
+
+
+class StoredRecord(object):
+    """
+    A view of one record in a RecordStore with the dictionary style access
+    of HierarchicalRecord. Reads and writes go straight to the store.
+    """
+
+    def __init__(self, store, record_id):
+        self.store = store
+        self.record_id = record_id
+
+    def __repr__(self):
+        return "<StoredRecord {}>".format(self.record_id)
+
+    def __getitem__(self, key):
+        if key[-1].isnumeric():
+            return self.get_value(key)
+        else:
+            return self.get_field(key)
+
+    def __setitem__(self, key, value):
+        if key[-1].isnumeric():
+            self.set_value(key, value)
+        else:
+            self.set_field(key, value)
+
+    def __delitem__(self, key):
+        if key[-1].isnumeric():
+            self.remove_value(key)
+        else:
+            self.remove_field(key)
+
+    def load(self):
+        """returns the whole record as a HierarchicalRecord"""
+        return self.store.get(self.record_id)
+
+    def keys(self):
+        return self.store.keys(self.record_id)
+
+    def get_value(self, key):
+        return self.store.get_value(self.record_id, key)
+
+    def get_field(self, key):
+        return self.store.get_field(self.record_id, key)
+
+    def set_value(self, key, value):
+        self.store.set_value(self.record_id, key, value)
+
+    def set_field(self, key, value):
+        self.store.set_field(self.record_id, key, value)
+
+    def add_to_field(self, key, value, create_if_necessary=True):
+        self.store.add_to_field(self.record_id, key, value,
+                                create_if_necessary)
+
+    def remove_value(self, key):
+        self.store.remove_value(self.record_id, key)
+
+    def remove_field(self, key):
+        self.store.remove_field(self.record_id, key)
@@ -1,35 +1,94 @@
 from re import compile as regex_compile
 
-from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord, \
+    generalize_key
+from hierarchicalrecord.recordconf import RecordConf
+from hierarchicalrecord.validationresults import ValidationError, BAD_KEY, \
+    MISSING, CARDINALITY, VALUE_TYPE, CHILDREN, VALIDATION, format_errors
+
+
+class _CompiledRule(object):
+    """the per-rule state validate() derives from a conf row"""
+    pass
+
+
+class _CompiledPlan(object):
+    """the whole conf, as prepared by RecordValidator.compile()"""
+    pass
+
+
+class _RecordIndex(object):
+    """
+    every key of a record in record.keys() order, with its generalized
+    form and value, and the positions of the keys for each generalized key
+    """
+
+    def __init__(self, keys, generalized, values):
+        self.keys = keys
+        self.values = values
+        self.by_field = {}
+        for i, x in enumerate(generalized):
+            positions = self.by_field.get(x)
+            if positions is None:
+                self.by_field[x] = [i]
+            else:
+                positions.append(i)
+        self.generalized = generalized
+
+
+# Below this many entries a plain comprehension beats building an array
+_NUMPY_MIN_BATCH = 256
+
+# numpy is optional, and slow enough to import that it is only imported
+# once a batch is big enough to use it
+_numpy = []
+
+
+def _get_numpy():
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+
+def _positions_where_not_equal(counts, expected):
+    numpy = _get_numpy() if len(counts) >= _NUMPY_MIN_BATCH else None
+    if numpy is not None:
+        return numpy.flatnonzero(numpy.asarray(counts) != expected).tolist()
+    return [i for i, x in enumerate(counts) if x != expected]
+
+
+def _positions_where_less(counts, expected):
+    numpy = _get_numpy() if len(counts) >= _NUMPY_MIN_BATCH else None
+    if numpy is not None:
+        return numpy.flatnonzero(numpy.asarray(counts) < expected).tolist()
+    return [i for i, x in enumerate(counts) if x < expected]
+
+
+class _CompiledRule(object):
+    """the per-rule state validate() derives from a conf row"""
+    pass
+
+
+class _CompiledPlan(object):
+    """the whole conf, as prepared by RecordValidator.compile()"""
+    pass
 
 
 class RecordValidator(object):
 
     _conf = None
+    _plan = None
+    _plan = None
 
     def __init__(self, conf):
         self.conf = conf
 
     def _generalize_key(self, key):
-        nums = [
-            "0", "1", "2", "3", "4", "5", "6", "7", "8", "9"
-        ]
-
-        splits = key.split(".")
-        generalized_splits = []
-        for split in splits:
-            stop_dropping = False
-            generalized_split = ""
-            for i in range(1, len(split)+1):
-                char = split[-i]
-                if stop_dropping:
-                    generalized_split = char + generalized_split
-                else:
-                    if char not in nums:
-                        generalized_split = char + generalized_split
-                        stop_dropping = True
-            generalized_splits.append(generalized_split)
-        return ".".join(generalized_splits)
+        return generalize_key(key)
 
     def _remove_last_index(self, key):
         splits = key.split(".")
@@ -69,6 +128,136 @@ class RecordValidator(object):
 
     def set_conf(self, conf):
         self._conf = conf
+        self._plan = None
+        self._plan = None
+
+    def _compile_rule(self, field_data, conf_data, suffixes=None):
+        rule = _CompiledRule()
+        rule.rule = field_data
+        rule.rule_id = field_data.get('id')
+        rule.field_name = field_data['Field Name']
+        rule.nested = "." in rule.field_name
+        rule.parent_name = ".".join(rule.field_name.split(".")[0:-1])
+        rule.leaf_key = rule.field_name.split(".")[-1]
+        rule.required = field_data['Obligation'] == "r"
+        rule.value_type = field_data['Value Type']
+        rule.cardinality = None
+        rule.comp_type = None
+        rule.req_children = None
+        rule.suffixes = None
+        rule.matcher = None
+        # A malformed cell only fails validation of records that actually
+        # carry the field, so hold on to the error rather than raising here
+        rule.error = None
+        try:
+            if field_data['Cardinality'] != "n":
+                rule.cardinality = int(field_data['Cardinality'])
+            if field_data['Value Type'] != "":
+                rule.comp_type = self._read_value_type(field_data['Value Type'])
+            if field_data['Children Required'] != "":
+                rule.req_children = int(field_data['Children Required'])
+                sub_fields = [x['Field Name'] for x in conf_data if
+                              rule.field_name+"." in x['Field Name'] and
+                              "." not in x['Field Name'].lstrip(rule.field_name+".")]
+                rule.suffixes = [x.split(".")[-1] for x in sub_fields]
+            if field_data['Validation'] != "":
+                rule.matcher = regex_compile(field_data['Validation'])
+        except Exception as e:
+            rule.error = e
+        return rule
+
+    def _build_plan(self, suffixes=None):
+        # [suffixes], one entry per rule, skips the search of the conf for
+        # each rule's children, which is the slow part for big confs
+        conf_data = self.conf.data
+        if suffixes is None:
+            suffixes = [None] * len(conf_data)
+        plan = _CompiledPlan()
+        plan.field_names = set(x['Field Name'] for x in conf_data)
+        plan.rules = [self._compile_rule(x, conf_data, y) for x, y in
+                      zip(conf_data, suffixes)]
+        return plan
+
+    def compile(self):
+        """
+        Precomputes everything validate() derives from the conf (field name
+        set, parsed cardinalities and types, child suffixes, compiled
+        regexes) and keeps it until the conf is replaced.
+
+        Validators that are never compiled rebuild this on every call to
+        validate(), so later edits to the conf are always honoured. Call
+        this once the conf is final, eg in a long running process.
+        """
+        self._plan = self._build_plan()
+        return self
+
+    def is_compiled(self):
+        return self._plan is not None
+
+    def _get_plan(self):
+        if self._plan is not None:
+            return self._plan
+        return self._build_plan()
+
+    def _compile_rule(self, field_data, conf_data):
+        rule = _CompiledRule()
+        rule.rule = field_data
+        rule.field_name = field_data['Field Name']
+        rule.nested = "." in rule.field_name
+        rule.parent_name = ".".join(rule.field_name.split(".")[0:-1])
+        rule.leaf_key = rule.field_name.split(".")[-1]
+        rule.required = field_data['Obligation'] == "r"
+        rule.cardinality = None
+        if field_data['Cardinality'] != "n":
+            rule.cardinality = int(field_data['Cardinality'])
+        rule.value_type = field_data['Value Type']
+        rule.comp_type = None
+        if rule.value_type != "":
+            try:
+                rule.comp_type = self._read_value_type(rule.value_type)
+            except ValueError:
+                # Surfaced by validate(), where the original check lives
+                rule.comp_type = None
+        rule.req_children = None
+        rule.suffixes = None
+        if field_data['Children Required'] != "":
+            rule.req_children = int(field_data['Children Required'])
+            sub_fields = [x['Field Name'] for x in conf_data if
+                          rule.field_name+"." in x['Field Name'] and
+                          "." not in x['Field Name'].lstrip(rule.field_name+".")]
+            rule.suffixes = [x.split(".")[-1] for x in sub_fields]
+        rule.matcher = None
+        if field_data['Validation'] != "":
+            rule.matcher = regex_compile(field_data['Validation'])
+        return rule
+
+    def _build_plan(self):
+        conf_data = self.conf.data
+        plan = _CompiledPlan()
+        plan.field_names = set(x['Field Name'] for x in conf_data)
+        plan.rules = [self._compile_rule(x, conf_data) for x in conf_data]
+        return plan
+
+    def compile(self):
+        """
+        Precomputes everything validate() derives from the conf (field name
+        set, parsed cardinalities and types, child suffixes, compiled
+        regexes) and keeps it until the conf is replaced.
+
+        Validators that are never compiled rebuild this on every call to
+        validate(), so later edits to the conf are always honoured. Call
+        this once the conf is final, eg in a long running process.
+        """
+        self._plan = self._build_plan()
+        return self
+
+    def is_compiled(self):
+        return self._plan is not None
+
+    def _get_plan(self):
+        if self._plan is not None:
+            return self._plan
+        return self._build_plan()
 
     def validate(self, record, strict=True, missing_is_error=True):
 
@@ -77,68 +266,69 @@ class RecordValidator(object):
         if not isinstance(record, HierarchicalRecord):
             raise ValueError('Not a HierarchicalRecord')
 
+        plan = self._get_plan()
+
         if strict is True:
-            field_names = [x['Field Name'] for x in self.conf.data]
             for key in record.keys():
-                if self._generalize_key(key) not in field_names:
+                if self._generalize_key(key) not in plan.field_names:
                     errors.append("Bad key: {}".format(key))
 
-        for field_data in self.conf.data:
+        for rule in plan.rules:
 
-            nested = "." in field_data['Field Name']
-            matching_keys = [key for key in record.keys() if self._generalize_key(key) == field_data['Field Name']]
+            nested = rule.nested
+            matching_keys = [key for key in record.keys() if self._generalize_key(key) == rule.field_name]
 
-            if field_data['Obligation'] == "r":
+            if rule.required:
                 if not nested:
                     if len(matching_keys) < 1:
                         if missing_is_error is True:
-                            errors.append("Missing required key: {}".format(field_data['Field Name']))
+                            errors.append("Missing required key: {}".format(rule.field_name))
                 else:
-                    parent_keys = [key for key in record.keys() if self._generalize_key(key) == ".".join(field_data['Field Name'].split(".")[0:-1])]
+                    parent_keys = [key for key in record.keys() if self._generalize_key(key) == rule.parent_name]
                     for key in parent_keys:
                         values = record[key]
-                        leaf_key = field_data['Field Name'].split(".")[-1]
+                        leaf_key = rule.leaf_key
                         if leaf_key not in values:
                             if missing_is_error is True:
                                 errors.append("Missing required key: {} from {}".format(leaf_key, key))
 
-            applicable_values = self._gather_applicable_values(field_data['Field Name'], record)
+            applicable_values = self._gather_applicable_values(rule.field_name, record)
             if len(applicable_values) == 0:
                 continue
 
-            if field_data['Cardinality'] != "n":
+            if rule.error is not None:
+                raise rule.error
+
+            if rule.cardinality is not None:
                 if not nested:
-                    if len(matching_keys) != int(field_data['Cardinality']):
-                        errors.append("Key cardinality error: {}".format(field_data['Field Name']))
+                    if len(matching_keys) != rule.cardinality:
+                        errors.append("Key cardinality error: {}".format(rule.field_name))
                 else:
-                    parent_keys = [key for key in record.keys() if self._generalize_key(key) == ".".join(field_data['Field Name'].split(".")[0:-1])]
-                    leaf_key = field_data['Field Name'].split(".")[-1]
+                    parent_keys = [key for key in record.keys() if self._generalize_key(key) == rule.parent_name]
+                    leaf_key = rule.leaf_key
                     for key in parent_keys:
                         values = record[key]
                         for value in values:
                             try:
-                                if len(values[leaf_key]) != int(field_data['Cardinality']):
-                                    errors.append("Key cardinality error: {} in {} ({} != {})".format(leaf_key, key, str(len(values[leaf_key])), str(int(field_data['Cardinality']))))
+                                if len(values[leaf_key]) != rule.cardinality:
+                                    errors.append("Key cardinality error: {} in {} ({} != {})".format(leaf_key, key, str(len(values[leaf_key])), str(rule.cardinality)))
                             except Exception as e:
                                 print(record.keys())
                                 print(values)
                                 print(leaf_key)
                                 raise
 
-            if field_data['Value Type'] != "":
-                comp_type = self._read_value_type(field_data['Value Type'])
+            if rule.comp_type is not None:
+                comp_type = rule.comp_type
                 for x in matching_keys:
                     if not isinstance(record[x], comp_type):
-                        errors.append("{} contains the wrong value type. Type should be {}, is {}".format(x, field_data['Value Type'], str(type(record[x]))))
+                        errors.append("{} contains the wrong value type. Type should be {}, is {}".format(x, rule.value_type, str(type(record[x]))))
 
-            if field_data['Children Required'] != "":
-                req_children = int(field_data['Children Required'])
+            if rule.req_children is not None:
+                req_children = rule.req_children
+                suffixes = rule.suffixes
                 for key in matching_keys:
                     children = 0
-                    sub_fields = [x['Field Name'] for x in self.conf.data if
-                                    field_data['Field Name']+"." in x['Field Name'] and
-                                    "." not in x['Field Name'].lstrip(field_data['Field Name']+".")]
-                    suffixes = [x.split(".")[-1] for x in sub_fields]
                     for x in suffixes:
                         try:
                             record[key+"."+x]
@@ -148,8 +338,8 @@ class RecordValidator(object):
                     if children < req_children:
                         errors.append("Fewer than the required number of children in {}. Include at least {} of {}".format(key, str(req_children), " or ".join([key+"."+x for x in suffixes])))
 
-            if field_data['Validation'] != "":
-                matcher = regex_compile(field_data['Validation'])
+            if rule.matcher is not None:
+                matcher = rule.matcher
                 for key in matching_keys:
                     if not matcher.match(str(record[key])):
                         errors.append("Value for {} does not match its validation".format(key))
@@ -160,3 +350,68 @@ class RecordValidator(object):
             return (False, errors)
 
     conf = property(get_conf, set_conf)
+
+
+# (conf name, version) -> compiled validator, for the life of the process
+_BATCH_VALIDATORS = {}
+
+
+class UncachedConfError(KeyError):
+    """
+    raised by validate_batch() when it is given no rules for a conf
+    version it hasn't built a validator for yet
+    """
+    pass
+
+
+def validate_batch(conf_key, rules, records, strict, missing_is_error):
+    """
+    validates a batch of record dicts, as the validation server's pool
+    workers and the work queue's workers do, returning validate()'s
+    structured result for each record or the exception it raised.
+    Validators are built once per conf version and kept for the life of
+    the process, so callers can pass [rules] as None once a process has
+    seen the version, and resend them if that raises UncachedConfError.
+
+    __Args__
+
+    1. conf_key (tuple): (conf name, version) identifying [rules]
+    2. rules (list): the rule dicts of the conf, or None
+    3. records (list): the record dicts to validate
+    4. strict (bool): see RecordValidator.validate()
+    5. missing_is_error (bool): see RecordValidator.validate()
+    """
+    validator = _BATCH_VALIDATORS.get(conf_key)
+    if validator is None:
+        if rules is None:
+            raise UncachedConfError(conf_key)
+        for stale in [x for x in _BATCH_VALIDATORS if x[0] == conf_key[0]]:
+            del _BATCH_VALIDATORS[stale]
+        conf = RecordConf()
+        for rule in rules:
+            conf.add_rule(rule)
+        validator = RecordValidator(conf).compile()
+        _BATCH_VALIDATORS[conf_key] = validator
+    results = [None] * len(records)
+    batch = []
+    for i, data in enumerate(records):
+        try:
+            record = HierarchicalRecord()
+            record.set_data(data)
+            batch.append((i, record))
+        except Exception as e:
+            results[i] = e
+    records = [x[1] for x in batch]
+    validated = validator._validate_batch(records, strict, missing_is_error)
+    for (i, record), result in zip(batch, validated):
+        if result is None:
+            # Left to validate(), which can raise; keep that from failing
+            # the rest of the batch
+            try:
+                result = validator.validate(
+                    record, strict=strict, missing_is_error=missing_is_error,
+                    structured=True)
+            except Exception as e:
+                result = e
+        results[i] = result
+    return results
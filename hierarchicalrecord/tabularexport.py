@@ -0,0 +1,156 @@
+from csv import writer as csv_writer
+from json import dumps
+
+"""
+Streams HierarchicalRecords out as CSV or TSV rows, for loading into
+spreadsheets, databases or dataframes.
+
+Long format has one row per leaf:
+
+    record_id,path,generalized,value
+    rec1.json,creator0.name0,creator.name,Someone
+
+Wide format has one row per record and one column per leaf field of a
+RecordConf, with the values of repeated fields joined by [joiner]:
+
+    record_id,title,creator.name
+    rec1.json,A Title,Someone|Someone Else
+
+Records are consumed one at a time from any iterable of (record id,
+record) pairs, and each is walked in place rather than through leaves(),
+so memory use doesn't grow with the size of the export.
+Output given as a path is written through a large buffer.
+
+    >>> write_long(((x, HierarchicalRecord(from_file=x)) for x in paths),
+    ...            "leaves.tsv", delimiter="\\t")
+
+Strings are written as they are, None as an empty cell and any other value
+as JSON, eg true or 1.5.
+"""
+
+
+_BUFFER_SIZE = 1 << 20
+
+
+def format_value(value):
+    """
+    returns the text a leaf value is written as
+
+    __Args__
+
+    1. value (any): a leaf value
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return dumps(value)
+
+
+def iter_leaves(record):
+    """
+    yields (key, generalized key, value) for each leaf of [record], in the
+    order of HierarchicalRecord.leaves(), without building a list
+
+    __Args__
+
+    1. record (HierarchicalRecord): the record
+    """
+    for path, generalized, value in record.walk():
+        if not isinstance(value, dict):
+            yield (path, generalized, value)
+
+
+def wide_fields(conf):
+    """
+    returns the generalized names of the fields in [conf] which hold
+    values rather than subfields, in conf order
+
+    __Args__
+
+    1. conf (RecordConf): the conf
+    """
+    names = []
+    for rule in conf.data:
+        if rule["Field Name"] not in names:
+            names.append(rule["Field Name"])
+    parents = set(x.rsplit(".", 1)[0] for x in names if "." in x)
+    return [x for x in names if x not in parents]
+
+
+def _export(records, out, write_rows, header, delimiter):
+    if isinstance(out, str):
+        with open(out, "w", newline="", encoding="utf-8",
+                  buffering=_BUFFER_SIZE) as f:
+            return _export(records, f, write_rows, header, delimiter)
+    w = csv_writer(out, delimiter=delimiter, lineterminator="\n")
+    rows = 0
+    if header is not None:
+        w.writerow(header)
+    for record_id, record in records:
+        rows += write_rows(w, record_id, record)
+    return rows
+
+
+def write_long(records, out, delimiter=",", header=True):
+    """
+    writes one row of (record id, key, generalized key, value) per leaf,
+    and returns the number of rows written, not counting the header
+
+    __Args__
+
+    1. records (iterable): (record id, HierarchicalRecord) pairs
+    2. out (str or file): a file path, or a file opened in text mode with
+    newline=""
+
+    __KWArgs__
+
+    * delimiter (str): "," for CSV, "\\t" for TSV
+    * header (bool): write a header row first
+    """
+    def write_rows(w, record_id, record):
+        rows = [(record_id, path, generalized, format_value(value)) for
+                path, generalized, value in iter_leaves(record)]
+        w.writerows(rows)
+        return len(rows)
+    if header:
+        header = ["record_id", "path", "generalized", "value"]
+    else:
+        header = None
+    return _export(records, out, write_rows, header, delimiter)
+
+
+def write_wide(records, out, conf, delimiter=",", joiner="|", header=True):
+    """
+    writes one row per record with a column per leaf field of [conf] (see
+    wide_fields()), and returns the number of rows written, not counting
+    the header. Leaves of fields the conf doesn't list are left out.
+
+    __Args__
+
+    1. records (iterable): see write_long()
+    2. out (str or file): see write_long()
+    3. conf (RecordConf): the conf listing the columns
+
+    __KWArgs__
+
+    * delimiter (str): "," for CSV, "\\t" for TSV
+    * joiner (str): put between the values of a field holding several
+    * header (bool): write a header row first
+    """
+    fields = wide_fields(conf)
+    columns = dict((x, i) for i, x in enumerate(fields))
+
+    def write_rows(w, record_id, record):
+        cells = [[] for x in fields]
+        for path, generalized, value in iter_leaves(record):
+            i = columns.get(generalized)
+            if i is not None:
+                cells[i].append(format_value(value))
+        w.writerow([record_id] + [joiner.join(x) for x in cells])
+        return 1
+    if header:
+        header = ["record_id"] + fields
+    else:
+        header = None
+    return _export(records, out, write_rows, header, delimiter)
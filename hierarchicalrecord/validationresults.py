@@ -0,0 +1,247 @@
+from collections import namedtuple
+
+"""
+Structured validation errors, and a streaming summary of them.
+
+RecordValidator.validate(structured=True) reports each problem as a
+ValidationError: a small tuple holding the kind of problem, the id of the
+conf rule involved, the generalized field and concrete key, and what was
+expected versus found. The English message validate() otherwise returns is
+only built when str() is called on one.
+
+ValidationAggregator consumes validation results one record at a time and
+keeps only counts, so a corpus of any size can be summarized per rule and
+per field.
+"""
+
+
+BAD_KEY = "bad_key"
+MISSING = "missing"
+CARDINALITY = "cardinality"
+VALUE_TYPE = "value_type"
+CHILDREN = "children"
+VALIDATION = "validation"
+
+# What ValidationAggregator reports unknown fields under, once it has seen
+# max_bad_fields distinct ones
+OTHER_BAD_FIELDS = "*"
+
+
+class ValidationError(namedtuple("ValidationError",
+                                 ["kind", "rule_id", "field", "key",
+                                  "expected", "actual", "detail"])):
+    """
+    One problem found in a record. This is a plain tuple, not an Exception.
+
+    __Attributes__
+
+    * kind (str): one of BAD_KEY, MISSING, CARDINALITY, VALUE_TYPE,
+    CHILDREN or VALIDATION
+    * rule_id (str): the id of the conf rule which failed, None for BAD_KEY
+    * field (str): the generalized field name
+    * key (str): the concrete key involved. For MISSING and CARDINALITY
+    errors on a nested field this is the parent holding the field, and for
+    the top level variants it is None
+    * expected: the declared cardinality, value type name, required child
+    count or validation pattern
+    * actual: the count, type or value found
+    * detail: for CHILDREN, the candidate child field names
+    """
+
+    __slots__ = ()
+
+    def leaf(self):
+        return self.field.split(".")[-1]
+
+    def message(self):
+        """returns the message RecordValidator.validate() reports by default"""
+        if self.kind == BAD_KEY:
+            return "Bad key: {}".format(self.key)
+        if self.kind == MISSING:
+            if self.key is None:
+                return "Missing required key: {}".format(self.field)
+            return "Missing required key: {} from {}".format(self.leaf(),
+                                                             self.key)
+        if self.kind == CARDINALITY:
+            if self.key is None:
+                return "Key cardinality error: {}".format(self.field)
+            return "Key cardinality error: {} in {} ({} != {})".format(
+                self.leaf(), self.key, str(self.actual), str(self.expected))
+        if self.kind == VALUE_TYPE:
+            return "{} contains the wrong value type. Type should be {}, is {}".format(
+                self.key, self.expected, str(self.actual))
+        if self.kind == CHILDREN:
+            return "Fewer than the required number of children in {}. Include at least {} of {}".format(
+                self.key, str(self.expected),
+                " or ".join([self.key+"."+x for x in self.detail]))
+        if self.kind == VALIDATION:
+            return "Value for {} does not match its validation".format(self.key)
+        return repr(self)
+
+    def __str__(self):
+        return self.message()
+
+    def to_dict(self):
+        """returns a JSON serializable dict of the error"""
+        actual = self.actual
+        if isinstance(actual, type):
+            actual = actual.__name__
+        result = {"kind": self.kind, "rule_id": self.rule_id,
+                  "field": self.field, "key": self.key,
+                  "expected": self.expected, "actual": actual}
+        if self.detail is not None:
+            result["detail"] = list(self.detail)
+        return result
+
+
+def format_errors(errors):
+    """
+    returns [errors] as the list of message strings validate() returns by
+    default. None and lists of strings pass through unchanged.
+
+    __Args__
+
+    1. errors (list): ValidationErrors, or None
+    """
+    if errors is None:
+        return None
+    return [str(x) for x in errors]
+
+
+class ValidationAggregator(object):
+    """
+    Summarizes structured validation results across a corpus in memory
+    bounded by the conf, not the number of records.
+
+    Fields the conf doesn't mention (BAD_KEY errors) aren't bounded by it,
+    so only the first [max_bad_fields] distinct ones are counted by name,
+    and the rest are counted together under OTHER_BAD_FIELDS.
+
+        >>> agg = ValidationAggregator()
+        >>> for record in records:
+        ...     agg.add(validator.validate(record, structured=True))
+        >>> agg.to_dict()
+    """
+
+    def __init__(self, max_examples=3, max_bad_fields=100):
+        """
+        __KWArgs__
+
+        * max_examples (int): how many example keys to keep for each
+        (kind, field) pair, for the errors which have a key
+        * max_bad_fields (int): how many fields the conf doesn't mention
+        to count by name
+        """
+        self.max_examples = max_examples
+        self.max_bad_fields = max_bad_fields
+        self._bad_fields = set()
+        self.records = 0
+        self.valid = 0
+        self.errors = 0
+        self.by_kind = {}
+        self.by_rule = {}
+        self.by_field = {}
+        self.records_by_field = {}
+        self.examples = {}
+
+    def _count(self, counts, key, n=1):
+        counts[key] = counts.get(key, 0) + n
+
+    def _field(self, kind, field):
+        if kind != BAD_KEY or field in self._bad_fields or \
+                field == OTHER_BAD_FIELDS:
+            return field
+        if len(self._bad_fields) < self.max_bad_fields:
+            self._bad_fields.add(field)
+            return field
+        return OTHER_BAD_FIELDS
+
+    def add(self, result):
+        """
+        adds one record's result
+
+        __Args__
+
+        1. result (tuple): the (valid, errors, ...) tuple from a
+        structured validate(). Any further entries, such as a ConfVersion,
+        are ignored
+        """
+        self.records += 1
+        errors = result[1]
+        if result[0]:
+            self.valid += 1
+        if not errors:
+            return
+        seen_fields = set()
+        for x in errors:
+            self.errors += 1
+            self._count(self.by_kind, x.kind)
+            if x.rule_id is not None:
+                self._count(self.by_rule, (x.rule_id, x.kind))
+            field = self._field(x.kind, x.field)
+            self._count(self.by_field, (field, x.kind))
+            seen_fields.add(field)
+            if self.max_examples and x.key is not None:
+                examples = self.examples.setdefault((x.kind, field), [])
+                if len(examples) < self.max_examples:
+                    examples.append(x.key)
+        for x in seen_fields:
+            self._count(self.records_by_field, x)
+
+    def add_many(self, results):
+        for x in results:
+            self.add(x)
+
+    def merge(self, other):
+        """
+        folds the counts of another aggregator, eg from a parallel shard,
+        into this one. Where unknown fields of [other] are newly counted
+        together under OTHER_BAD_FIELDS, its record count is an upper bound
+
+        __Args__
+
+        1. other (ValidationAggregator): the aggregator to fold in
+        """
+        self.records += other.records
+        self.valid += other.valid
+        self.errors += other.errors
+        for mine, theirs in [(self.by_kind, other.by_kind),
+                             (self.by_rule, other.by_rule)]:
+            for k, v in theirs.items():
+                self._count(mine, k, v)
+        bad_fields = other._bad_fields | set([OTHER_BAD_FIELDS])
+        for (field, kind), v in other.by_field.items():
+            self._count(self.by_field, (self._field(kind, field), kind), v)
+        for field, v in other.records_by_field.items():
+            if field in bad_fields:
+                field = self._field(BAD_KEY, field)
+            self._count(self.records_by_field, field, v)
+        for (kind, field), v in other.examples.items():
+            examples = self.examples.setdefault(
+                (kind, self._field(kind, field)), [])
+            examples.extend(v[:max(self.max_examples - len(examples), 0)])
+
+    def to_dict(self):
+        """returns a JSON serializable summary"""
+        by_rule = {}
+        for (rule_id, kind), n in self.by_rule.items():
+            by_rule.setdefault(rule_id, {})[kind] = n
+        by_field = {}
+        for (field, kind), n in self.by_field.items():
+            entry = by_field.setdefault(field, {"records": 0, "errors": {}})
+            entry["errors"][kind] = n
+        for field, n in self.records_by_field.items():
+            by_field[field]["records"] = n
+        examples = {}
+        for (kind, field), keys in self.examples.items():
+            examples.setdefault(field, {})[kind] = keys
+        return {
+            "records": self.records,
+            "valid": self.valid,
+            "invalid": self.records - self.valid,
+            "errors": self.errors,
+            "by_kind": dict(self.by_kind),
+            "by_rule": by_rule,
+            "by_field": by_field,
+            "examples": examples
+        }
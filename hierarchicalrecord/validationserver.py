@@ -0,0 +1,503 @@
+import asyncio
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from json import dumps, loads
+from socket import AF_UNIX, create_connection, socket as make_socket
+from time import perf_counter
+
+from hierarchicalrecord.confregistry import ConfRegistry, UnknownConfError
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+from hierarchicalrecord.recordvalidator import UncachedConfError, \
+    validate_batch
+from hierarchicalrecord.validationresults import ValidationError, \
+    format_errors
+
+"""
+An asyncio front end which keeps compiled validators resident in a long
+lived process and answers validation requests sent to it as line delimited
+JSON over TCP or a unix socket.
+
+Each request is a single JSON object on its own line, eg:
+
+    {"id": 1, "conf": "mods", "record": {...}, "strict": true}
+
+and is answered by a single line:
+
+    {"id": 1, "conf": "mods", "conf_version": 3, "valid": false,
+     "errors": [...]}
+
+Adding "structured": true to a request returns each error as a dict (see
+ValidationError.to_dict()) instead of a message string.
+
+Responses on one connection are written as soon as they are ready, so they
+may arrive out of order; use "id" to match them up. Two further requests,
+{"op": "confs"} and {"op": "stats"}, list the loaded confs and report
+latency histograms.
+
+The CPU bound validate() calls are grouped into batches per conf and run
+in a process pool. The number of requests in flight is capped, and once
+that cap is hit the server stops reading from its sockets until a slot
+frees up, which pushes back on clients through TCP flow control.
+"""
+
+
+class LatencyHistogram(object):
+    """
+    A fixed size histogram of durations with logarithmically spaced
+    buckets, from 50 microseconds up to a minute.
+    """
+
+    _BOUNDS = [0.00005 * (2 ** (x / 2)) for x in range(41)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self._BOUNDS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """
+        records a single duration
+
+        __Args__
+
+        1. seconds (float): the duration to record
+        """
+        self.counts[bisect_left(self._BOUNDS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        returns the upper bound of the bucket holding the [p]th percentile
+
+        __Args__
+
+        1. p (float): a percentile between 0 and 100
+        """
+        if self.total == 0:
+            return None
+        target = self.total * p / 100.0
+        seen = 0
+        for i, x in enumerate(self.counts):
+            seen += x
+            if seen >= target and x > 0:
+                if i < len(self._BOUNDS):
+                    return self._BOUNDS[i]
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        """returns a JSON serializable summary of the histogram"""
+        buckets = []
+        for i, x in enumerate(self.counts):
+            if x == 0:
+                continue
+            if i < len(self._BOUNDS):
+                buckets.append([self._BOUNDS[i], x])
+            else:
+                buckets.append(["inf", x])
+        return {
+            "count": self.total,
+            "mean": self.sum / self.total if self.total else None,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": buckets
+        }
+
+
+class _Batch(object):
+    """the requests for one (conf, flags) combination awaiting dispatch"""
+
+    def __init__(self, key):
+        self.key = key
+        self.rules = None
+        self.records = []
+        self.futures = []
+        self.timer = None
+
+
+class ValidationServer(object):
+    """
+    Serves validation requests against the confs of a ConfRegistry. See
+    the module docstring for the wire format.
+    """
+
+    def __init__(self, registry=None, executor=None, max_workers=None,
+                 max_pending=1024, batch_size=64, batch_delay=0.002,
+                 line_limit=2 ** 24):
+        """
+        __KWArgs__
+
+        * registry (ConfRegistry): the confs to serve. Defaults to a new,
+        empty registry. Swapping a conf in the registry takes effect for
+        the next request which names it
+        * executor (concurrent.futures.Executor): where validate() calls
+        run. Defaults to a ProcessPoolExecutor owned by the server
+        * max_workers (int): the worker count of the default executor
+        * max_pending (int): the most requests admitted at once
+        * batch_size (int): the most records sent to a worker in one call
+        * batch_delay (float): how long, in seconds, a partial batch waits
+        for company before it is dispatched anyway
+        * line_limit (int): the longest request line accepted, in bytes
+        """
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.executor = executor
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.line_limit = line_limit
+        if registry is None:
+            registry = ConfRegistry()
+        self.registry = registry
+        self._batches = {}
+        self._pending = None
+        self._servers = []
+        self._connections = set()
+        self.latency = {}
+        self.batch_latency = LatencyHistogram()
+        self.batch_sizes = {}
+
+    def add_conf(self, name, conf):
+        """
+        makes [conf] available under [name], replacing any conf already
+        registered with that name. Requests already batched keep the
+        version they were admitted with.
+
+        __Args__
+
+        1. name (str): the name clients use to select the conf
+        2. conf (RecordConf): the conf
+        """
+        return self.registry.add(name, conf)
+
+    def load_conf(self, name, conf_fp):
+        """
+        reads a conf file and registers it under [name]
+
+        __Args__
+
+        1. name (str): the name clients use to select the conf
+        2. conf_fp (str): the path to a CSV or line JSON conf file
+        """
+        return self.registry.load(name, conf_fp)
+
+    def remove_conf(self, name):
+        self.registry.remove(name)
+
+    def conf_names(self):
+        return self.registry.names()
+
+    def stats(self):
+        """returns a JSON serializable summary of the server's latencies"""
+        return {
+            "confs": self.conf_names(),
+            "max_pending": self.max_pending,
+            "latency": dict((k, v.to_dict()) for k, v in
+                            self.latency.items()),
+            "batch_latency": self.batch_latency.to_dict(),
+            "batch_sizes": dict((str(k), v) for k, v in
+                                sorted(self.batch_sizes.items()))
+        }
+
+    async def validate(self, conf_name, record_data, strict=True,
+                       missing_is_error=True, structured=False):
+        """
+        validates a record dict against the current version of a named
+        conf, batching it with other requests for that version. Returns
+        (valid, errors, ConfVersion). A record which makes the validator
+        raise is reported as invalid, with the single error message
+        "Could not validate record: ..." (a str even if [structured]).
+        Raises UnknownConfError if no conf is registered as [conf_name]
+
+        __Args__
+
+        1. conf_name (str): the name of a registered conf
+        2. record_data (dict): the internal dict of a HierarchicalRecord
+
+        __KWArgs__
+
+        * strict (bool): see RecordValidator.validate()
+        * missing_is_error (bool): see RecordValidator.validate()
+        * structured (bool): see RecordValidator.validate()
+        """
+        version = self.registry.get(conf_name)
+        if not isinstance(record_data, dict):
+            raise ValueError("record must be a JSON object")
+        key = (conf_name, version.version, bool(strict),
+               bool(missing_is_error))
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = _Batch(key)
+            batch.rules = version.conf.data
+            self._batches[key] = batch
+            batch.timer = loop.call_later(self.batch_delay,
+                                          self._dispatch, key)
+        future = loop.create_future()
+        batch.records.append(record_data)
+        batch.futures.append(future)
+        if len(batch.records) >= self.batch_size:
+            self._dispatch(key)
+        result = await future
+        if isinstance(result, Exception):
+            # The record itself couldn't be validated, eg it is malformed
+            # in a way validate() raises on
+            return (False, ["Could not validate record: {}".format(result)],
+                    version)
+        if structured:
+            return (result[0], result[1], version)
+        return (result[0], format_errors(result[1]), version)
+
+    def _dispatch(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        conf_name, version, strict, missing_is_error = key
+        loop = asyncio.get_running_loop()
+        started = perf_counter()
+        self.batch_sizes[len(batch.records)] = \
+            self.batch_sizes.get(len(batch.records), 0) + 1
+
+        def submit(rules):
+            job = loop.run_in_executor(self.executor, validate_batch,
+                                       (conf_name, version), rules,
+                                       batch.records, strict,
+                                       missing_is_error)
+            job.add_done_callback(done)
+
+        def done(job):
+            try:
+                results = job.result()
+            except UncachedConfError:
+                # Workers keep the validators they have built, so the rules
+                # only go out to one which hasn't seen this version yet
+                submit(batch.rules)
+                return
+            except Exception as e:
+                self.batch_latency.observe(perf_counter() - started)
+                for future in batch.futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self.batch_latency.observe(perf_counter() - started)
+            for future, result in zip(batch.futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+        submit(None)
+
+    async def _answer(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        op = request.get("op", "validate")
+        if op == "confs":
+            return {"confs": self.conf_names()}
+        if op == "stats":
+            return {"stats": self.stats()}
+        if op != "validate":
+            raise ValueError("unknown op: {}".format(op))
+        conf_name = request.get("conf")
+        started = perf_counter()
+        structured = request.get("structured", False)
+        valid, errors, version = await self.validate(
+            conf_name, request.get("record"),
+            strict=request.get("strict", True),
+            missing_is_error=request.get("missing_is_error", True),
+            structured=structured)
+        if structured and errors is not None:
+            errors = [x.to_dict() if isinstance(x, ValidationError) else x
+                      for x in errors]
+        latency = self.latency.get(conf_name)
+        if latency is None:
+            latency = self.latency.setdefault(conf_name, LatencyHistogram())
+        latency.observe(perf_counter() - started)
+        return {"conf": conf_name, "conf_version": version.version,
+                "conf_digest": version.digest, "valid": valid,
+                "errors": errors}
+
+    async def _respond(self, line, writer, lock):
+        request_id = None
+        try:
+            try:
+                request = loads(line)
+                if isinstance(request, dict):
+                    request_id = request.get("id")
+                response = await self._answer(request)
+            except UnknownConfError as e:
+                response = {"error": "unknown conf: {}".format(e.args[0])}
+            except Exception as e:
+                response = {"error": str(e) or type(e).__name__}
+            response["id"] = request_id
+            async with lock:
+                writer.write(dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._pending.release()
+
+    async def _handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                # Admission happens before the next read, so a saturated
+                # server leaves requests in the socket buffers
+                await self._pending.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    line = b""
+                if not line.strip():
+                    self._pending.release()
+                    if not line:
+                        break
+                    continue
+                task = asyncio.ensure_future(
+                    self._respond(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    def _ensure_started(self):
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+
+    async def start_tcp(self, host="127.0.0.1", port=0):
+        """
+        starts listening on a TCP socket and returns the bound
+        (host, port), which is useful when [port] is 0
+
+        __KWArgs__
+
+        * host (str): the address to bind
+        * port (int): the port to bind, 0 picks a free one
+        """
+        self._ensure_started()
+        server = await asyncio.start_server(self._handle_connection,
+                                            host, port,
+                                            limit=self.line_limit)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    async def start_unix(self, path):
+        """
+        starts listening on a unix socket
+
+        __Args__
+
+        1. path (str): the path of the socket file
+        """
+        self._ensure_started()
+        server = await asyncio.start_unix_server(self._handle_connection,
+                                                 path, limit=self.line_limit)
+        self._servers.append(server)
+        return path
+
+    async def serve_forever(self):
+        await asyncio.gather(*[x.serve_forever() for x in self._servers])
+
+    async def close(self):
+        """
+        stops listening, drops open connections and shuts down an executor
+        the server created
+        """
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        connections = list(self._connections)
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        if self._owns_executor:
+            self.executor.shutdown(wait=True)
+
+
+class ValidationClient(object):
+    """
+    A minimal blocking client for ValidationServer, which sends one request
+    at a time.
+    """
+
+    def __init__(self, host="127.0.0.1", port=None, unix_path=None,
+                 timeout=None):
+        """
+        __KWArgs__
+
+        * host (str): the server's address when using TCP
+        * port (int): the server's port when using TCP
+        * unix_path (str): the server's socket file, instead of host/port
+        * timeout (float): socket timeout in seconds
+        """
+        if unix_path is not None:
+            self._sock = make_socket(AF_UNIX)
+            self._sock.settimeout(timeout)
+            self._sock.connect(unix_path)
+        else:
+            self._sock = create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile("rwb")
+        self._ids = count()
+
+    def request(self, request):
+        """
+        sends a raw request dict and returns the decoded response
+
+        __Args__
+
+        1. request (dict): the request
+        """
+        request = dict(request)
+        request.setdefault("id", next(self._ids))
+        self._file.write(dumps(request).encode("utf-8") + b"\n")
+        self._file.flush()
+        response = loads(self._file.readline())
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def validate(self, conf_name, record, strict=True, missing_is_error=True):
+        """
+        validates a record, returning the same (valid, errors) tuple as
+        RecordValidator.validate()
+
+        __Args__
+
+        1. conf_name (str): the name of a conf loaded in the server
+        2. record (HierarchicalRecord or dict): the record to validate
+
+        __KWArgs__
+
+        * strict (bool): see RecordValidator.validate()
+        * missing_is_error (bool): see RecordValidator.validate()
+        """
+        if isinstance(record, HierarchicalRecord):
+            record = record.get_data()
+        response = self.request({"conf": conf_name, "record": record,
+                                 "strict": strict,
+                                 "missing_is_error": missing_is_error})
+        return (response["valid"], response["errors"])
+
+    def stats(self):
+        return self.request({"op": "stats"})["stats"]
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
@@ -0,0 +1,369 @@
+from bisect import bisect_left
+from json import dumps, loads
+from mmap import ACCESS_READ, mmap
+from os import replace
+from struct import Struct
+
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord, \
+    generalize_key
+
+"""
+An inverted index of leaf values across many records.
+
+ValueIndex maps (generalized key, value) pairs, eg ("identifier.value",
+"abc123"), to the (record id, key) pairs holding them, eg ("rec1.json",
+"identifier0.value0"). It is built from HierarchicalRecord.leaves(), and
+records can be added, updated and removed at any time.
+
+    >>> index = ValueIndex()
+    >>> for path, record in load_records("records/*.json"):
+    ...     index.add_record(path, record)
+    >>> index.lookup("identifier.value", "abc123")
+    [('records/rec1.json', 'identifier0.value0')]
+    >>> index.save("records.hrvi")
+
+A saved index is opened with MappedValueIndex, which answers the same
+queries straight from the memory mapped file without reading it in, so
+opening even a very large index is immediate.
+
+    >>> with MappedValueIndex("records.hrvi") as index:
+    ...     index.prefix_lookup("identifier.value", "abc")
+
+Values are matched by their JSON form, so 1, 1.0 and True are distinct.
+
+The file is laid out as a header, a table of record ids, a table of terms
+sorted by their UTF-8 bytes, a table of postings grouped by term, and the
+strings the tables point into. Each term is the generalized key, a NUL
+and the value's JSON.
+"""
+
+
+_MAGIC = b"HRVI"
+_VERSION = 1
+_HEADER = Struct("<4sIIII")
+_RECORD = Struct("<QI")
+_TERM = Struct("<QIII")
+_POSTING = Struct("<IQI")
+
+
+def _encode(value):
+    return dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _term(generalized, value):
+    return generalized + "\x00" + _encode(value)
+
+
+def _prefix_term(generalized, prefix):
+    if not isinstance(prefix, str):
+        raise TypeError("prefix must be a str")
+    # drop the closing quote, JSON escapes each character on its own so
+    # the rest is a prefix of every longer string's JSON
+    return generalized + "\x00" + _encode(prefix)[:-1]
+
+
+def _split_term(term):
+    generalized, value = term.split("\x00", 1)
+    return generalized, loads(value)
+
+
+class ValueIndex(object):
+    """
+    An in memory, updatable inverted index of leaf values. See the module
+    docstring for an example.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        # The terms in order, built on demand and dropped whenever a term
+        # comes or goes, so building an index never sorts as it goes
+        self._sorted_terms = None
+        self._records = {}
+
+    def __contains__(self, record_id):
+        return record_id in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def record_ids(self):
+        return sorted(self._records.keys())
+
+    def add_record(self, record_id, record):
+        """
+        indexes the leaves of a record, replacing any already indexed under
+        [record_id]
+
+        __Args__
+
+        1. record_id (str): the id to report the record's values under
+        2. record (HierarchicalRecord or list): the record, or the output
+        of its leaves()
+        """
+        if record_id in self._records:
+            self.remove_record(record_id)
+        if isinstance(record, HierarchicalRecord):
+            leaves = [(key, generalized, value) for key, generalized, value
+                      in record.walk() if not isinstance(value, dict)]
+        else:
+            leaves = [(key, generalize_key(key), value)
+                      for key, value in record]
+        entries = []
+        for key, generalized, value in leaves:
+            term = _term(generalized, value)
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = set()
+                self._postings[term] = postings
+                self._sorted_terms = None
+            postings.add((record_id, key))
+            entries.append((term, key))
+        self._records[record_id] = entries
+
+    def update_record(self, record_id, record):
+        """see add_record()"""
+        self.add_record(record_id, record)
+
+    def add_many(self, records):
+        """
+        __Args__
+
+        1. records (iterable): (record id, HierarchicalRecord) pairs
+        """
+        for record_id, record in records:
+            self.add_record(record_id, record)
+
+    def remove_record(self, record_id):
+        """
+        drops every value indexed under [record_id]
+
+        __Args__
+
+        1. record_id (str): the id of the record
+        """
+        for term, key in self._records.pop(record_id):
+            postings = self._postings[term]
+            postings.discard((record_id, key))
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def _terms(self):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        return self._sorted_terms
+
+    def lookup(self, generalized, value):
+        """
+        returns a sorted list of the (record id, key) pairs where a leaf of
+        [generalized] equals [value]
+
+        __Args__
+
+        1. generalized (str): a generalized key, eg identifier.value
+        2. value (any): the value to match
+        """
+        return sorted(self._postings.get(_term(generalized, value), ()))
+
+    def prefix_lookup(self, generalized, prefix):
+        """
+        returns a list of (record id, key, value) for every string leaf of
+        [generalized] starting with [prefix], in order of value
+
+        __Args__
+
+        1. generalized (str): a generalized key, eg identifier.value
+        2. prefix (str): the start of the values to match
+        """
+        start = _prefix_term(generalized, prefix)
+        terms = self._terms()
+        result = []
+        for i in range(bisect_left(terms, start), len(terms)):
+            term = terms[i]
+            if not term.startswith(start):
+                break
+            value = _split_term(term)[1]
+            for record_id, key in sorted(self._postings[term]):
+                result.append((record_id, key, value))
+        return result
+
+    def items(self):
+        """
+        yields (generalized key, value, record id, key) for every indexed
+        leaf, in the order the index is saved in
+        """
+        for term in self._terms():
+            generalized, value = _split_term(term)
+            for record_id, key in sorted(self._postings[term]):
+                yield (generalized, value, record_id, key)
+
+    def save(self, path):
+        """
+        writes the index to [path] for MappedValueIndex. The file is
+        written alongside and moved into place, so readers never see a
+        partial index.
+
+        __Args__
+
+        1. path (str): the file to write
+        """
+        blob = []
+        blob_size = [0]
+
+        def add_string(s):
+            b = s.encode("utf-8")
+            offset = blob_size[0]
+            blob.append(b)
+            blob_size[0] += len(b)
+            return offset, len(b)
+
+        record_ids = self.record_ids()
+        record_numbers = dict((x, i) for i, x in enumerate(record_ids))
+        records = [_RECORD.pack(*add_string(x)) for x in record_ids]
+        terms = []
+        postings = []
+        for term in self._terms():
+            offset, length = add_string(term)
+            term_postings = sorted(self._postings[term])
+            terms.append(_TERM.pack(offset, length, len(postings),
+                                    len(term_postings)))
+            for record_id, key in term_postings:
+                postings.append(_POSTING.pack(record_numbers[record_id],
+                                              *add_string(key)))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(records), len(terms),
+                                 len(postings)))
+            for table in (records, terms, postings, blob):
+                f.write(b"".join(table))
+        replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        reads a saved index back into an updatable ValueIndex
+
+        __Args__
+
+        1. path (str): a file written by save()
+        """
+        index = cls()
+        with MappedValueIndex(path) as mapped:
+            # Records without any leaves have no postings, but are still
+            # in the index
+            entries = dict((x, []) for x in mapped.record_ids())
+            for generalized, value, record_id, key in mapped.items():
+                entries[record_id].append((key, value))
+        for record_id, leaves in entries.items():
+            index.add_record(record_id, leaves)
+        return index
+
+
+class MappedValueIndex(object):
+    """
+    A read only index file written by ValueIndex.save(), queried in place
+    through a memory map. Should be closed (or used as a context manager)
+    when done with.
+    """
+
+    def __init__(self, path):
+        """
+        __Args__
+
+        1. path (str): a file written by ValueIndex.save()
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap(f.fileno(), 0, access=ACCESS_READ)
+        magic, version, n_records, n_terms, n_postings = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._map.close()
+            raise ValueError("{} is not a value index file".format(path))
+        self._n_records = n_records
+        self._n_terms = n_terms
+        self._records_at = _HEADER.size
+        self._terms_at = self._records_at + n_records * _RECORD.size
+        self._postings_at = self._terms_at + n_terms * _TERM.size
+        self._blob_at = self._postings_at + n_postings * _POSTING.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._n_records
+
+    def close(self):
+        self._map.close()
+
+    def _string(self, offset, length):
+        start = self._blob_at + offset
+        return self._map[start:start + length]
+
+    def _record_id(self, i):
+        return self._string(*_RECORD.unpack_from(
+            self._map, self._records_at + i * _RECORD.size)).decode("utf-8")
+
+    def _term_entry(self, i):
+        return _TERM.unpack_from(self._map, self._terms_at + i * _TERM.size)
+
+    def _term_bytes(self, i):
+        offset, length, first, count = self._term_entry(i)
+        return self._string(offset, length)
+
+    def _postings(self, i):
+        offset, length, first, count = self._term_entry(i)
+        result = []
+        for j in range(first, first + count):
+            record, key_offset, key_length = _POSTING.unpack_from(
+                self._map, self._postings_at + j * _POSTING.size)
+            result.append((self._record_id(record),
+                           self._string(key_offset,
+                                        key_length).decode("utf-8")))
+        return result
+
+    def _bisect(self, target):
+        lo = 0
+        hi = self._n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def record_ids(self):
+        return [self._record_id(i) for i in range(self._n_records)]
+
+    def lookup(self, generalized, value):
+        """see ValueIndex.lookup()"""
+        target = _term(generalized, value).encode("utf-8")
+        i = self._bisect(target)
+        if i < self._n_terms and self._term_bytes(i) == target:
+            return self._postings(i)
+        return []
+
+    def prefix_lookup(self, generalized, prefix):
+        """see ValueIndex.prefix_lookup()"""
+        start = _prefix_term(generalized, prefix).encode("utf-8")
+        result = []
+        for i in range(self._bisect(start), self._n_terms):
+            term = self._term_bytes(i)
+            if not term.startswith(start):
+                break
+            value = _split_term(term.decode("utf-8"))[1]
+            for record_id, key in self._postings(i):
+                result.append((record_id, key, value))
+        return result
+
+    def items(self):
+        """see ValueIndex.items()"""
+        for i in range(self._n_terms):
+            generalized, value = _split_term(
+                self._term_bytes(i).decode("utf-8"))
+            for record_id, key in self._postings(i):
+                yield (generalized, value, record_id, key)
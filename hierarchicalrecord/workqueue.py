@@ -0,0 +1,436 @@
+import asyncio
+from collections import deque
+from hashlib import sha256
+from json import dumps, loads
+from socket import create_connection
+from time import monotonic, sleep
+
+from hierarchicalrecord.confregistry import conf_from_bytes
+from hierarchicalrecord.recordvalidator import validate_batch
+from hierarchicalrecord.validationresults import format_errors
+
+"""
+Spreads the validation of a line delimited JSON stream of records across
+worker processes on any number of machines.
+
+A QueueCoordinator reads the stream, one record's internal dict per line,
+and hands it out in leases of [lease_size] records to QueueWorkers which
+connect to it over TCP. Each worker fetches the conf once when it connects,
+then repeatedly leases records, validates them with a compiled
+RecordValidator and sends back the results. The coordinator writes one
+result line per record, in the order of the input, as the leases ahead of
+it complete:
+
+    {"line": 3, "valid": false, "errors": ["Missing required key: title"]}
+
+A lease which isn't returned within [lease_timeout] seconds, or whose
+worker disconnects, goes back on the queue. After [max_attempts] failed
+attempts its records are reported as failing to validate instead, so one
+record which crashes workers can't stall the run. If a lease was given
+out more than once, the first result returned for it is used.
+
+The coordinator only reads ahead of the oldest unfinished lease by
+[max_outstanding] leases, so memory stays bounded however long the stream.
+
+The protocol is one JSON object per line in each direction. A worker sends
+{"op": "hello"} once, then {"op": "lease"}, which is answered with a lease,
+{"wait": seconds} while every remaining record is leased out, or
+{"done": true} at the end, and {"op": "result", "lease": n, "results": [...]}
+after validating each lease.
+"""
+
+
+class _Lease(object):
+    """a run of consecutive records, handed to workers as a unit"""
+
+    def __init__(self, number, lines):
+        self.number = number
+        # [(line number, line)]
+        self.lines = lines
+        self.attempts = 0
+        self.holders = set()
+        self.deadline = None
+        self.results = None
+
+
+class QueueCoordinator(object):
+    """
+    Leases out a stream of records to QueueWorkers and merges their results
+    back into order. See the module docstring for the details.
+
+        >>> coordinator = QueueCoordinator("conf.csv", records_file, out)
+        >>> host, port = await coordinator.start_tcp("0.0.0.0", 8766)
+        >>> summary = await coordinator.wait_finished()
+        >>> await coordinator.close()
+    """
+
+    def __init__(self, conf_fp, records, out, lease_size=256,
+                 lease_timeout=60.0, max_attempts=3, max_outstanding=64,
+                 strict=True, missing_is_error=True, structured=False,
+                 line_limit=2 ** 26):
+        """
+        __Args__
+
+        1. conf_fp (str): the path to a CSV or line JSON conf file
+        2. records (iterable): lines of JSON, one record's internal dict
+        each, eg a file opened in text mode. Blank lines are skipped
+        3. out (file): where result lines are written, opened in text mode
+
+        __KWArgs__
+
+        * lease_size (int): the number of records in a lease
+        * lease_timeout (float): seconds a worker may hold a lease before
+        it is given to another worker
+        * max_attempts (int): how many times a lease is handed out before
+        its records are reported as failed
+        * max_outstanding (int): the most leases read ahead of the oldest
+        one not yet written out
+        * strict (bool): see RecordValidator.validate()
+        * missing_is_error (bool): see RecordValidator.validate()
+        * structured (bool): report errors as dicts (see
+        ValidationError.to_dict()) instead of message strings
+        * line_limit (int): the longest message accepted from a worker,
+        in bytes
+        """
+        with open(conf_fp, "rb") as f:
+            content = f.read()
+        self.conf_digest = sha256(content).hexdigest()
+        self.rules = conf_from_bytes(conf_fp, content).data
+        self.out = out
+        self.lease_size = lease_size
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.max_outstanding = max_outstanding
+        self.strict = strict
+        self.missing_is_error = missing_is_error
+        self.structured = structured
+        self.line_limit = line_limit
+        self._lines = enumerate(records, 1)
+        self._exhausted = False
+        self._leases = {}
+        self._queue = deque()
+        self._next_number = 0
+        self._next_write = 0
+        self._read_lock = None
+        self._finished = None
+        self._servers = []
+        self._connections = set()
+        self._reaper = None
+        self.records = 0
+        self.valid = 0
+        self.retries = 0
+        self.failed_leases = 0
+
+    def _ensure_started(self):
+        if self._finished is None:
+            self._finished = asyncio.Event()
+            self._read_lock = asyncio.Lock()
+            self._reaper = asyncio.ensure_future(self._reap())
+
+    def summary(self):
+        """returns a JSON serializable summary of the run so far"""
+        return {
+            "records": self.records,
+            "valid": self.valid,
+            "invalid": self.records - self.valid,
+            "leases": self._next_write,
+            "retries": self.retries,
+            "failed_leases": self.failed_leases
+        }
+
+    def _read_chunk(self):
+        lines = []
+        for line_number, line in self._lines:
+            if not line.strip():
+                continue
+            lines.append((line_number, line))
+            if len(lines) >= self.lease_size:
+                break
+        return lines
+
+    async def _next_lease(self):
+        while self._queue:
+            lease = self._queue.popleft()
+            if lease.results is None:
+                return lease
+        if self._exhausted or \
+                self._next_number - self._next_write >= self.max_outstanding:
+            return None
+        async with self._read_lock:
+            if self._exhausted:
+                return None
+            loop = asyncio.get_running_loop()
+            # Reading may block, eg on a pipe, so keep it off the loop
+            lines = await loop.run_in_executor(None, self._read_chunk)
+            if len(lines) < self.lease_size:
+                self._exhausted = True
+            if not lines:
+                self._check_finished()
+                return None
+            lease = _Lease(self._next_number, lines)
+            self._leases[lease.number] = lease
+            self._next_number += 1
+            return lease
+
+    def _check_finished(self):
+        if self._exhausted and self._next_write == self._next_number:
+            self._finished.set()
+
+    def _release(self, lease, holder):
+        """puts a lease a worker failed to return back on the queue"""
+        lease.holders.discard(holder)
+        if lease.results is not None or lease.holders:
+            return
+        if lease.attempts >= self.max_attempts:
+            self.failed_leases += 1
+            message = "Could not validate record: gave up after " + \
+                "{} attempts".format(lease.attempts)
+            self._complete(lease, [{"valid": False, "errors": [message]}
+                                   for x in lease.lines])
+            return
+        self.retries += 1
+        self._queue.append(lease)
+
+    def _complete(self, lease, results):
+        lease.results = results
+        lease.holders.clear()
+        while self._next_write in self._leases and \
+                self._leases[self._next_write].results is not None:
+            done = self._leases.pop(self._next_write)
+            for (line_number, line), result in zip(done.lines, done.results):
+                self.records += 1
+                if result["valid"]:
+                    self.valid += 1
+                self.out.write(dumps({"line": line_number,
+                                      "valid": result["valid"],
+                                      "errors": result["errors"]}) + "\n")
+            self._next_write += 1
+        self.out.flush()
+        self._check_finished()
+
+    async def _reap(self):
+        """requeues leases held past their deadline"""
+        while True:
+            await asyncio.sleep(max(self.lease_timeout / 4, 0.01))
+            now = monotonic()
+            for lease in list(self._leases.values()):
+                if lease.holders and lease.results is None and \
+                        lease.deadline < now:
+                    for holder in list(lease.holders):
+                        self._release(lease, holder)
+
+    async def _answer(self, request, holder):
+        op = request.get("op")
+        if op == "hello":
+            return {"conf": self.rules, "conf_digest": self.conf_digest,
+                    "strict": self.strict,
+                    "missing_is_error": self.missing_is_error,
+                    "structured": self.structured}
+        if op == "lease":
+            lease = await self._next_lease()
+            if lease is None:
+                if self._finished.is_set():
+                    return {"done": True}
+                return {"wait": min(max(self.lease_timeout / 4, 0.01), 1.0)}
+            lease.attempts += 1
+            lease.holders.add(holder)
+            lease.deadline = monotonic() + self.lease_timeout
+            return {"lease": lease.number,
+                    "records": [x[1] for x in lease.lines]}
+        if op == "result":
+            lease = self._leases.get(request.get("lease"))
+            if lease is None or lease.results is not None:
+                # already written out, from an earlier attempt
+                return {"ok": True}
+            results = request.get("results")
+            if not isinstance(results, list) or \
+                    len(results) != len(lease.lines):
+                self._release(lease, holder)
+                raise ValueError("lease {} returned the wrong number of "
+                                 "results".format(lease.number))
+            self._complete(lease, results)
+            return {"ok": True}
+        raise ValueError("unknown op: {}".format(op))
+
+    async def _handle_connection(self, reader, writer):
+        holder = object()
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                    response = await self._answer(request, holder)
+                except Exception as e:
+                    response = {"error": str(e) or type(e).__name__}
+                writer.write(dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(asyncio.current_task())
+            # Whatever this worker still held goes to someone else
+            for lease in list(self._leases.values()):
+                if holder in lease.holders:
+                    self._release(lease, holder)
+            writer.close()
+
+    async def start_tcp(self, host="127.0.0.1", port=0):
+        """
+        starts listening for workers and returns the bound (host, port),
+        which is useful when [port] is 0
+
+        __KWArgs__
+
+        * host (str): the address to bind
+        * port (int): the port to bind, 0 picks a free one
+        """
+        self._ensure_started()
+        server = await asyncio.start_server(self._handle_connection,
+                                            host, port,
+                                            limit=self.line_limit)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    async def wait_finished(self):
+        """
+        waits until every record has been validated and written out, and
+        returns summary()
+        """
+        self._ensure_started()
+        await self._finished.wait()
+        return self.summary()
+
+    async def close(self):
+        """stops listening and drops any workers still connected"""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        connections = list(self._connections)
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+
+
+def _result_dict(result, structured):
+    if isinstance(result, Exception):
+        return {"valid": False,
+                "errors": ["Could not validate record: {}".format(result)]}
+    valid, errors = result
+    if errors is not None:
+        if structured:
+            errors = [x.to_dict() for x in errors]
+        else:
+            errors = format_errors(errors)
+    return {"valid": valid, "errors": errors}
+
+
+class QueueWorker(object):
+    """
+    Connects to a QueueCoordinator and validates leases until the
+    coordinator reports it is done.
+    """
+
+    def __init__(self, host="127.0.0.1", port=None, timeout=None):
+        """
+        __KWArgs__
+
+        * host (str): the coordinator's address
+        * port (int): the coordinator's port
+        * timeout (float): socket timeout in seconds
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.leases = 0
+        self.records = 0
+
+    def _request(self, f, request):
+        f.write(dumps(request).encode("utf-8") + b"\n")
+        f.flush()
+        line = f.readline()
+        if not line:
+            raise ConnectionError("the coordinator closed the connection")
+        response = loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def validate_lease(self, lines):
+        """
+        returns the result dicts for a lease's JSON lines
+
+        __Args__
+
+        1. lines (list): one record's internal dict as JSON per entry
+        """
+        results = [None] * len(lines)
+        parsed = []
+        for i, line in enumerate(lines):
+            try:
+                data = loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError("a record must be a JSON object")
+                parsed.append((i, data))
+            except ValueError as e:
+                results[i] = {"valid": False,
+                              "errors": ["Could not load record: {}".format(
+                                  e)]}
+        validated = validate_batch(("workqueue", self.conf_digest),
+                                   self.rules, [x[1] for x in parsed],
+                                   self.strict, self.missing_is_error)
+        for (i, data), result in zip(parsed, validated):
+            results[i] = _result_dict(result, self.structured)
+        return results
+
+    def run(self):
+        """
+        validates leases until the coordinator is done, and returns the
+        number of records this worker validated
+        """
+        sock = create_connection((self.host, self.port),
+                                 timeout=self.timeout)
+        f = sock.makefile("rwb")
+        try:
+            hello = self._request(f, {"op": "hello"})
+            self.rules = hello["conf"]
+            self.conf_digest = hello["conf_digest"]
+            self.strict = hello["strict"]
+            self.missing_is_error = hello["missing_is_error"]
+            self.structured = hello["structured"]
+            while True:
+                try:
+                    response = self._request(f, {"op": "lease"})
+                except ConnectionError:
+                    # a finished coordinator may stop listening before an
+                    # idle worker hears it is done
+                    break
+                if response.get("done"):
+                    break
+                if "wait" in response:
+                    sleep(response["wait"])
+                    continue
+                results = self.validate_lease(response["records"])
+                self._request(f, {"op": "result",
+                                  "lease": response["lease"],
+                                  "results": results})
+                self.leases += 1
+                self.records += len(results)
+        finally:
+            f.close()
+            sock.close()
+        return self.records
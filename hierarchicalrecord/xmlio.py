@@ -0,0 +1,247 @@
+from re import compile as regex_compile
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+
+"""
+Streams HierarchicalRecords to and from XML of the shape the README
+describes, where each element is one value of the field named by its tag:
+
+    <record>
+        <key>
+            <nest>value_0</nest>
+            <nest>value_1</nest>
+        </key>
+    </record>
+
+is the record {"key": [{"nest": ["value_0", "value_1"]}]}.
+
+iterparse_records() reads a file incrementally, building each record as
+its closing tag is reached and discarding the parsed elements as it goes,
+so memory is bounded by the largest record rather than the file. Given a
+[record_tag], one file yields a record for every such element, wherever it
+is in the document:
+
+    >>> for record in iterparse_records("collection.xml", record_tag="c"):
+    ...     store.put(record["did0.unitid0"], record)
+
+write_records() walks records and writes the XML text directly, without
+building a tree, so it can write any number of records to one file.
+
+The mapping:
+
+* An element with child elements is a nested dict, one without is a leaf
+* Leaf text is always read as a str. An empty element is None
+* Namespaces are dropped from tags
+* A tag ending in a digit, which can't be a field name, gets an
+underscore appended (eg EAD's c01 becomes c01_), and loses it on output
+* Dots, which separate the parts of a key, are read as U+00B7 middle
+dots (eg dc.title becomes dc\u00b7title), and written back as dots
+* Text before the first child of an element with children is kept in a
+"#text" field, which is written before the children, and stops them being
+indented. Text after a child is dropped
+* With attributes=True, an element's attributes are read into fields
+named "@" plus the attribute's name, each holding one str, and an element
+with attributes is always a dict. The writer turns "@" fields back into
+attributes
+* Field names which aren't XML names once mapped back (eg "my field",
+"1st" or "a:b") can't be written, and raise a ValueError
+"""
+
+
+ATTRIBUTE_PREFIX = "@"
+TEXT_FIELD = "#text"
+DOT_REPLACEMENT = "\u00b7"
+
+# The Name production of XML 1.0, less the colon, which would need a
+# namespace declaration to read back
+_NAME_START_CHARS = "A-Z_a-z\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u02ff" + \
+    "\u0370-\u037d\u037f-\u1fff\u200c-\u200d\u2070-\u218f" + \
+    "\u2c00-\u2fef\u3001-\ud7ff\uf900-\ufdcf\ufdf0-\ufffd" + \
+    "\U00010000-\U000effff"
+_XML_NAME_REGEX = regex_compile(
+    "[{0}][{0}\\-.0-9\u00b7\u0300-\u036f\u203f-\u2040]*$".format(
+        _NAME_START_CHARS))
+
+
+def _local_name(tag):
+    if tag[0] == "{":
+        return tag.split("}", 1)[1]
+    return tag
+
+
+def _field_name(name):
+    name = name.replace(".", DOT_REPLACEMENT)
+    if name[-1] in "0123456789":
+        return name + "_"
+    return name
+
+
+def _tag_name(field):
+    if len(field) > 1 and field[-1] == "_" and field[-2] in "0123456789":
+        field = field[:-1]
+    return field.replace(DOT_REPLACEMENT, ".")
+
+
+def _check_name(name):
+    if not _XML_NAME_REGEX.match(name):
+        raise ValueError("{!r} is not a valid XML name".format(name))
+    return name
+
+
+def _element_value(elem, fields, attributes):
+    if attributes and elem.attrib:
+        for name, value in elem.attrib.items():
+            fields[ATTRIBUTE_PREFIX + _field_name(_local_name(name))] = \
+                [value]
+    if not fields:
+        if elem.text:
+            return elem.text
+        return None
+    if elem.text is not None and elem.text.strip():
+        fields.setdefault(TEXT_FIELD, []).append(elem.text)
+    return fields
+
+
+def iterparse_records(source, record_tag=None, attributes=False):
+    """
+    yields a HierarchicalRecord for each record in an XML document
+
+    __Args__
+
+    1. source (str or file): a file path, or a file opened in binary mode
+
+    __KWArgs__
+
+    * record_tag (str): the tag, without a namespace, of the elements
+    holding one record each. Elements with this tag inside a record are
+    ordinary fields of it. Defaults to the document's root being the only
+    record
+    * attributes (bool): read attributes too, see the module docstring
+    """
+    # (element, its fields so far or None outside any record, is a record)
+    stack = []
+    for event, elem in iterparse(source, events=("start", "end")):
+        if event == "start":
+            in_record = bool(stack) and stack[-1][1] is not None
+            if not in_record and (record_tag is None and not stack or
+                                  _local_name(elem.tag) == record_tag):
+                stack.append((elem, {}, True))
+            elif in_record:
+                stack.append((elem, {}, False))
+            else:
+                stack.append((elem, None, False))
+            continue
+        elem, fields, is_record = stack.pop()
+        if is_record:
+            record = HierarchicalRecord()
+            value = _element_value(elem, fields, attributes)
+            record.set_data(value if isinstance(value, dict) else {})
+            yield record
+        elif fields is not None:
+            value = _element_value(elem, fields, attributes)
+            stack[-1][1].setdefault(_field_name(_local_name(elem.tag)),
+                                    []).append(value)
+        # Free what has been read. Each element is removed from its parent
+        # as soon as it ends, so a parent never holds more than one child
+        elem.clear()
+        if stack:
+            stack[-1][0].remove(elem)
+
+
+def _write_value(write, tag, value, indent, depth):
+    _check_name(tag)
+    pad = ""
+    if indent is not None:
+        pad = "\n" + indent * depth
+    if isinstance(value, dict):
+        attrs = []
+        children = []
+        for field in value:
+            if field.startswith(ATTRIBUTE_PREFIX):
+                values = [x for x in value[field] if x is not None]
+                if len(values) > 1:
+                    raise ValueError(
+                        "{} holds more than one value".format(field))
+                if values:
+                    attrs.append(" {}={}".format(
+                        _check_name(_tag_name(
+                            field[len(ATTRIBUTE_PREFIX):])),
+                        quoteattr(str(values[0]))))
+            else:
+                children.append(field)
+        write("{}<{}{}>".format(pad, tag, "".join(attrs)))
+        # Only text ahead of the first child element is read back
+        text = [x for x in value.get(TEXT_FIELD, ()) if x is not None]
+        for x in text:
+            write(escape(str(x)))
+        if text:
+            # Indenting would add whitespace to the text
+            indent = None
+        for field in children:
+            if field == TEXT_FIELD:
+                continue
+            for x in value[field]:
+                _write_value(write, _tag_name(field), x, indent, depth + 1)
+        if indent is not None and children and children != [TEXT_FIELD]:
+            write(pad)
+        write("</{}>".format(tag))
+    elif value is None:
+        write("{}<{} />".format(pad, tag))
+    elif isinstance(value, list):
+        raise ValueError("A value in {} is a list, which has no XML "
+                         "form".format(tag))
+    else:
+        write("{}<{}>{}</{}>".format(pad, tag, escape(str(value)), tag))
+
+
+def write_record(record, f, tag="record", indent=None, depth=0):
+    """
+    writes one record as a single element, without an XML declaration
+
+    __Args__
+
+    1. record (HierarchicalRecord): the record to write
+    2. f (file): a file opened in text mode
+
+    __KWArgs__
+
+    * tag (str): the tag of the element holding the record
+    * indent (str): indent nested elements by this much, eg "    ".
+    Defaults to writing everything on one line
+    * depth (int): how many indents the record element itself gets
+    """
+    _write_value(f.write, tag, record.get_data(), indent, depth)
+
+
+def write_records(records, out, root_tag="records", record_tag="record",
+                  indent=None):
+    """
+    writes many records into one XML document, which
+    iterparse_records(out, record_tag=[record_tag]) reads back
+
+    __Args__
+
+    1. records (iterable): HierarchicalRecords
+    2. out (str or file): a file path, or a file opened in text mode
+
+    __KWArgs__
+
+    * root_tag (str): the tag of the document's root element
+    * record_tag (str): the tag of each record's element
+    * indent (str): see write_record()
+    """
+    if isinstance(out, str):
+        with open(out, "w", encoding="utf-8") as f:
+            write_records(records, f, root_tag=root_tag,
+                          record_tag=record_tag, indent=indent)
+        return
+    _check_name(root_tag)
+    out.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    out.write("<{}>".format(root_tag))
+    for record in records:
+        write_record(record, out, tag=record_tag, indent=indent, depth=1)
+    if indent is not None:
+        out.write("\n")
+    out.write("</{}>\n".format(root_tag))
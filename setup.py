@@ -24,7 +24,11 @@ setup(
         ],
     entry_points = {
         'console_scripts':[
-            'validatehr = hierarchicalrecord.bin.validaterecord:main'
+            'validatehr = hierarchicalrecord.bin.validaterecord:main',
+            'validatehr-server = hierarchicalrecord.bin.validationserver:main',
+            'inferhrconf = hierarchicalrecord.bin.inferconf:main',
+            'validatehr-queue = hierarchicalrecord.bin.validationqueue:main',
+            'exporthr = hierarchicalrecord.bin.exportrecords:main'
         ]
     }
     )
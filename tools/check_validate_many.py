@@ -0,0 +1,113 @@
+from argparse import ArgumentParser
+from os.path import abspath, dirname
+from random import Random
+from sys import exit, path
+
+# Run from a checkout, without installing the package first
+path.insert(0, dirname(dirname(abspath(__file__))))
+
+from hierarchicalrecord.hierarchicalrecord import HierarchicalRecord
+from hierarchicalrecord.recordconf import RecordConf
+from hierarchicalrecord.recordvalidator import RecordValidator
+
+"""
+A correctness check rather than a benchmark: checks that
+RecordValidator.validate_many() gives the result validate() does for every
+record, over random confs and random records.
+
+    $ python tools/check_validate_many.py
+    $ python tools/check_validate_many.py --batches 10000 --seed 7
+
+The records deliberately include None placeholders, scalars where dicts
+are expected and dicts where scalars are, since those are where the
+batched path has to reproduce validate()'s quirks. Exits with status 1 if
+any batch disagrees, printing the first few.
+"""
+
+
+FIELDS = ["a", "b", "c", "a.b", "a.c", "b.a", "a.b.c", "c.a"]
+NAMES = ["a", "b", "c"]
+
+
+def random_data(rand, depth=0):
+    node = {}
+    for name in rand.sample(NAMES, rand.randint(0, len(NAMES))):
+        values = []
+        for i in range(rand.randint(1, 3)):
+            x = rand.random()
+            if depth < 2 and x < 0.4:
+                values.append(random_data(rand, depth + 1))
+            elif x < 0.5:
+                values.append(None)
+            elif x < 0.7:
+                values.append(rand.choice(["v1", "x", "v22"]))
+            elif x < 0.85:
+                values.append(rand.randint(0, 3))
+            else:
+                values.append(True)
+        node[name] = values
+    return node
+
+
+def random_conf(rand):
+    conf = RecordConf()
+    for name in rand.sample(FIELDS, rand.randint(1, len(FIELDS))):
+        conf.add_rule({"Field Name": name,
+                       "Value Type": rand.choice(["", "str", "int", "dict"]),
+                       "Obligation": rand.choice(["r", "o"]),
+                       "Cardinality": rand.choice(["n", "1", "2"]),
+                       "Validation": rand.choice(["", "^v[0-9]+$"]),
+                       "Children Required": rand.choice(["", "1", "2"])})
+    return conf
+
+
+def outcome(f):
+    try:
+        return f()
+    except Exception as e:
+        return type(e)
+
+
+def compare(batches, batch_size, seed, show=3):
+    rand = Random(seed)
+    mismatches = 0
+    for x in range(batches):
+        validator = RecordValidator(random_conf(rand))
+        if rand.random() < 0.5:
+            validator.compile()
+        records = []
+        for i in range(batch_size):
+            record = HierarchicalRecord()
+            record.set_data(random_data(rand))
+            records.append(record)
+        expected = [outcome(lambda: validator.validate(r)) for r in records]
+        raised = [r for r in expected if isinstance(r, type)]
+        if raised:
+            # validate_many() raises whatever the first failing record does
+            expected = raised[0]
+        got = outcome(lambda: validator.validate_many(records))
+        if got != expected:
+            mismatches += 1
+            if mismatches <= show:
+                print([r["Field Name"] + ":" + r["Children Required"] for
+                       r in validator.conf.data])
+                print([r.get_data() for r in records], expected, got,
+                      sep="\n    ")
+    return mismatches
+
+
+def main():
+    parser = ArgumentParser(description="Compare validate_many() with " +
+                            "validate() on random confs and records")
+    parser.add_argument("--batches", type=int, default=3000)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    mismatches = compare(args.batches, args.batch_size, args.seed)
+    print("{} of {} batches disagree".format(mismatches, args.batches))
+    if mismatches:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()